@@ -0,0 +1,72 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of collection construction.
+
+Times building collections of ROWS rows with the constructor and with the
+from_rows, from_columns and from_buffer constructors, and building the child
+collections of a grouped collection.
+
+    make benchmark
+"""
+
+from array import array
+from timeit import repeat
+
+from datalib.hcollections import Collection, NamedCollection
+
+
+ROWS = 100000
+NAMES = ('id', 'value', 'label')
+
+
+def _cases():
+    """Return (name, function) for each construction to time."""
+    tuples = [(idx, idx * 0.5, 'label%s' % (idx % 10)) for idx in xrange(ROWS)]
+    ids = array('l', xrange(ROWS))
+    values = array('d', (idx * 0.5 for idx in xrange(ROWS)))
+    labels = [row[2] for row in tuples]
+    lists = [list(row) for row in tuples]
+    buffer = bytearray(ids.tostring() + values.tostring())
+
+    def _children():
+        col = NamedCollection(NAMES, tuples, group=['label'])
+        for row in col:
+            row.children
+
+    return [
+        ('Collection(tuples)', lambda: Collection(tuples)),
+        ('Collection.from_rows(tuples)', lambda: Collection.from_rows(tuples)),
+        ('Collection.from_rows(lists)', lambda: Collection.from_rows(lists)),
+        ('Collection(tuples, schema)',
+            lambda: Collection(tuples, schema={0: 'int64', 1: 'float64'})),
+        ('Collection.from_columns',
+            lambda: Collection.from_columns([ids, values, labels])),
+        ('Collection.from_buffer',
+            lambda: Collection.from_buffer(buffer, ['int64', 'float64'])),
+        ('NamedCollection(tuples)', lambda: NamedCollection(NAMES, tuples)),
+        ('grouped child collections', _children),
+    ]
+
+
+def main():
+    print "%s rows, best of 3 (ms)" % ROWS
+    for name, fn in _cases():
+        print "%-32s %8.1f" % (name, min(repeat(fn, number=1, repeat=3)) * 1000)
+
+
+if __name__ == '__main__':
+    main()
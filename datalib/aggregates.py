@@ -0,0 +1,242 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Column aggregates.
+
+Aggregates are folded over a column one value at a time.  The running state
+is kept by the collection so it can be updated when rows are appended,
+instead of re-reading every row of the group.  The built-in aggregates fold
+whole columns with the C-level builtins, which run straight over the arrays
+of typed columns.
+"""
+
+
+class Aggregate(object):
+    """Base column aggregate.
+
+    Aggregates of the same type and settings are equal, so they share
+    running state.
+    """
+
+    def __eq__(self, other):
+        return type(self) is type(other) and vars(self) == vars(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def initial(self):
+        """Return state of the aggregate before any values are seen."""
+        return None
+
+    def step(self, state, value):
+        """Return new state after folding in value."""
+        raise NotImplementedError
+
+    def final(self, state):
+        """Return aggregate value for given state."""
+        return state
+
+    def merge(self, state, other):
+        """Return state combining two partial states."""
+        raise NotImplementedError
+
+    def fold(self, values, state=None):
+        """Fold all of values into state (or a new state).
+
+        >>> Sum().fold([1, 2, 3])
+        6
+        """
+        if state is None:
+            state = self.initial()
+        for value in values:
+            state = self.step(state, value)
+        return state
+
+
+class Count(Aggregate):
+    """Number of values.
+
+    >>> Count().final(Count().fold('abc'))
+    3
+    """
+
+    def initial(self):
+        return 0
+
+    def step(self, state, value):
+        return state + 1
+
+    def fold(self, values, state=None):
+        if state is None:
+            state = self.initial()
+        if hasattr(values, '__len__'):
+            return state + len(values)
+        return state + sum(1 for value in values)
+
+    def merge(self, state, other):
+        return state + other
+
+
+class Sum(Aggregate):
+    """Sum of values.
+
+    >>> Sum().final(Sum().fold([1, 2.5]))
+    3.5
+    """
+
+    def initial(self):
+        return 0
+
+    def step(self, state, value):
+        return state + value
+
+    def fold(self, values, state=None):
+        if state is None:
+            state = self.initial()
+        return state + sum(values)
+
+    def merge(self, state, other):
+        return state + other
+
+
+class Min(Aggregate):
+    """Smallest value.
+
+    >>> Min().final(Min().fold([3, 1, 2]))
+    1
+    """
+
+    def step(self, state, value):
+        if state is None or value < state:
+            return value
+        return state
+
+    def fold(self, values, state=None):
+        try:
+            return self.step(state, min(values))
+        except ValueError:
+            # no values
+            return state
+
+    def merge(self, state, other):
+        if other is None:
+            return state
+        return self.step(state, other)
+
+
+class Max(Aggregate):
+    """Largest value.
+
+    >>> Max().final(Max().fold([3, 1, 2]))
+    3
+    """
+
+    def step(self, state, value):
+        if state is None or value > state:
+            return value
+        return state
+
+    def fold(self, values, state=None):
+        try:
+            return self.step(state, max(values))
+        except ValueError:
+            # no values
+            return state
+
+    def merge(self, state, other):
+        if other is None:
+            return state
+        return self.step(state, other)
+
+
+class Mean(Aggregate):
+    """Arithmetic mean of values.
+
+    >>> Mean().final(Mean().fold([1, 2, 3, 4]))
+    2.5
+    >>> Mean().final(Mean().initial()) is None
+    True
+    """
+
+    def initial(self):
+        return (0, 0)
+
+    def step(self, state, value):
+        return (state[0] + value, state[1] + 1)
+
+    def fold(self, values, state=None):
+        if state is None:
+            state = self.initial()
+        if not hasattr(values, '__len__'):
+            values = list(values)
+        return (state[0] + sum(values), state[1] + len(values))
+
+    def merge(self, state, other):
+        return (state[0] + other[0], state[1] + other[1])
+
+    def final(self, state):
+        total, count = state
+        if not count:
+            return None
+        return float(total) / count
+
+
+class Reduce(Aggregate):
+    """Apply a plain function to the full list of values.
+
+    The values are kept in the state, so prefer one of the folding
+    aggregates when one exists.
+
+    >>> agg = Reduce(sorted)
+    >>> agg.final(agg.fold([3, 1, 2]))
+    [1, 2, 3]
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def initial(self):
+        return []
+
+    def step(self, state, value):
+        state.append(value)
+        return state
+
+    def merge(self, state, other):
+        return state + other
+
+    def final(self, state):
+        return self.fn(state)
+
+
+def aggregator(spec):
+    """Return Aggregate instance for given aggregate class, instance or
+    plain function.
+
+    >>> isinstance(aggregator(Sum), Sum)
+    True
+    >>> agg = aggregator(sum)
+    >>> agg.final(agg.fold([1, 2]))
+    3
+    """
+    if isinstance(spec, Aggregate):
+        return spec
+    if isinstance(spec, type) and issubclass(spec, Aggregate):
+        return spec()
+    return Reduce(spec)
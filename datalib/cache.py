@@ -0,0 +1,141 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Result cache for repeated transactions.
+
+Transactions are fingerprinted by their instructions: strings and column
+names as they are, functions by their code objects, defaults, closure values
+and the globals (and attributes of global modules) they read, and aggregates
+by their type and settings.  Together with the state token of the collection
+a transaction is committed on, the fingerprint keys the collection state the
+transaction produced.
+"""
+
+from collections import OrderedDict
+from types import CodeType, FunctionType, ModuleType
+
+from datalib.aggregates import Aggregate
+
+
+class Unfingerprintable(Exception):
+    """Raised for instructions that can not be fingerprinted (results of
+    such transactions are not cached)."""
+    pass
+
+
+def _global_names(code):
+    """Return names code (and code nested in it) may read as globals."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def fingerprint(value, _functions=None, _names=None):
+    """Return hashable fingerprint of a transaction instruction.
+
+    Functions are fingerprinted with the current values of the globals they
+    read, so a function reading a changed global does not match.  Modules
+    they read are fingerprinted by the values of the attributes named in
+    their code.
+
+    >>> fingerprint(lambda r, c: r[0] + 1) == fingerprint(lambda r, c: r[0] + 1)
+    True
+    >>> fingerprint(lambda r, c: r[0] + 1) == fingerprint(lambda r, c: r[0] + 2)
+    False
+    """
+    if _functions is None:
+        _functions = set()
+    if isinstance(value, FunctionType):
+        if id(value) in _functions:
+            # recursive reference, already being fingerprinted
+            return ('function', value.__name__)
+        _functions.add(id(value))
+        names = _global_names(value.func_code)
+        closure = [cell.cell_contents for cell in value.func_closure or ()]
+        module = value.func_globals
+        global_values = sorted((name, fingerprint(module[name], _functions,
+            names)) for name in names if name in module)
+        return ('function', fingerprint(value.func_code),
+                fingerprint(value.func_defaults or (), _functions, names),
+                fingerprint(closure, _functions, names), tuple(global_values))
+    if isinstance(value, CodeType):
+        return ('code', value.co_code, fingerprint(value.co_consts),
+                value.co_names, value.co_varnames)
+    if isinstance(value, (tuple, list)):
+        return (type(value).__name__,) + tuple(fingerprint(x, _functions,
+            _names) for x in value)
+    if isinstance(value, ModuleType):
+        if id(value) in _functions or not _names:
+            return ('module', value.__name__)
+        _functions.add(id(value))
+        return ('module', value.__name__, tuple((name,
+            fingerprint(getattr(value, name), _functions, _names))
+            for name in sorted(_names) if hasattr(value, name)))
+    if isinstance(value, Aggregate):
+        return ('aggregate', type(value),
+                fingerprint(sorted(vars(value).items()), _functions))
+    try:
+        hash(value)
+    except TypeError:
+        raise Unfingerprintable(value)
+    return value
+
+
+class TransactionCache(object):
+    """LRU cache of collection states produced by committed transactions.
+
+    Entries are keyed on the state token of the collection, which changes
+    whenever the collection is changed, so an entry is never returned for a
+    collection that changed after it was stored.  Entries that can no longer
+    be reached are dropped as the least recently used.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return ("<TransactionCache %s entries, %s hits, %s misses>"
+                % (len(self._entries), self.hits, self.misses))
+
+    def clear(self):
+        """Drop all entries."""
+        self._entries.clear()
+
+    def get(self, key):
+        """Return entry for key (None if there is none)."""
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """Store entry for key, dropping least recently used entries."""
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
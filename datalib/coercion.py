@@ -0,0 +1,194 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Column coercion.
+
+Coercions convert a collection's rows one column at a time.  Conversion runs
+over the whole column with the C-level map builtin, and only falls back to
+converting cell by cell (to find failing values) if that fails.  Common
+types have parsing fast paths, and large columns can be converted in chunks
+by forked worker processes.
+"""
+
+from datetime import date, datetime
+from itertools import izip
+from multiprocessing import Pool
+
+
+# rows per chunk given to a worker process
+CHUNK_SIZE = 65536
+
+# exceptions raised by conversions of bad values
+CONVERSION_ERRORS = (TypeError, ValueError, ArithmeticError)
+
+ERROR_POLICIES = ('strict', 'null', 'collect')
+
+
+class CoercionError(ValueError):
+    """Raised when values could not be coerced.
+
+    errors lists (row, column, value, message) for every failing cell (only
+    the first one under the strict policy).
+    """
+
+    def __init__(self, errors):
+        ValueError.__init__(self, errors)
+        self.errors = errors
+
+    def __str__(self):
+        row, column, value, message = self.errors[0]
+        return ("%s value(s) could not be coerced, first at row %s, "
+                "column %s: %r (%s)" % (len(self.errors), row, column, value,
+                    message))
+
+
+def parse_date(value):
+    """Convert ISO-8601 date string (or date/datetime) to date.
+
+    Dates of date-typed columns (see datalib.columns) are parsed with it too.
+
+    >>> parse_date('2010-06-01')
+    datetime.date(2010, 6, 1)
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, basestring):
+        raise TypeError("cannot parse date from %s" % type(value).__name__)
+    value = value.strip()
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date(int(value[:4]), int(value[5:7]), int(value[8:]))
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+# converters used in place of the coercion type itself
+PARSERS = {date: parse_date}
+
+
+def converter(type_):
+    """Return function converting values to type_ (any callable)."""
+    return PARSERS.get(type_, type_)
+
+
+def coerce_column(values, convert, errors='strict', start=0, column=None):
+    """Return values converted by convert, and a list of (row, column, value,
+    message) of the values that failed (rows are counted from start).
+
+    None values stay None.  Under the strict policy the first failing value
+    raises CoercionError; otherwise failing values are replaced by None.
+
+    >>> coerce_column(['1', None, 'x', '4'], int, 'null')[0]
+    [1, None, None, 4]
+    >>> coerce_column([None, '1'], str)[0]
+    [None, '1']
+    """
+    try:
+        if None in values:
+            return [None if value is None else convert(value)
+                    for value in values], []
+        return map(convert, values), []
+    except CONVERSION_ERRORS:
+        pass
+
+    converted, failures = [], []
+    for row, value in enumerate(values, start):
+        if value is None:
+            converted.append(None)
+            continue
+        try:
+            converted.append(convert(value))
+        except CONVERSION_ERRORS, ex:
+            failures.append((row, column, value, str(ex)))
+            if errors == 'strict':
+                raise CoercionError(failures)
+            converted.append(None)
+    return converted, failures
+
+
+# Columns of the running coercion, inherited by the forked worker processes.
+_JOB = None
+
+
+def _coerce_chunk(task):
+    """Coerce a chunk of a column (in a worker process)."""
+    columns, errors = _JOB
+    column, start = task
+    values, convert = columns[column]
+    return coerce_column(values[start:start + CHUNK_SIZE], convert, errors,
+            start, column)
+
+
+def _coerce_parallel(columns, errors, processes):
+    """Return results of coerce_column for columns, converted in chunks by
+    a pool of worker processes."""
+    global _JOB
+
+    tasks = [(column, start) for column, (values, convert)
+            in sorted(columns.iteritems())
+            for start in xrange(0, len(values), CHUNK_SIZE)]
+    _JOB = (columns, errors)
+    pool = Pool(processes)
+    try:
+        chunks = pool.map(_coerce_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+        _JOB = None
+
+    results = dict((column, ([], [])) for column in columns)
+    for (column, start), (converted, failures) in zip(tasks, chunks):
+        results[column][0].extend(converted)
+        results[column][1].extend(failures)
+    return results
+
+
+def coerce_rows(rows, coercions, errors='strict', processes=1):
+    """Apply coercions (a mapping of column position to type) to rows in
+    place, column by column.
+
+    Under the collect policy, failing values are replaced by None and a
+    CoercionError listing all of them is raised once every column has been
+    converted.  With several processes (None for one per CPU), columns of
+    more than CHUNK_SIZE rows are converted in chunks by a pool of forked
+    worker processes.
+
+    >>> rows = [['1', '2.5'], ['x', 'y']]
+    >>> coerce_rows(rows, {0: int, 1: float}, 'collect')
+    Traceback (most recent call last):
+    ...
+    CoercionError: 2 value(s) could not be coerced, first at row 1, column 0: 'x' (invalid literal for int() with base 10: 'x')
+    >>> rows
+    [[1, 2.5], [None, None]]
+    """
+    if errors not in ERROR_POLICIES:
+        raise ValueError("unknown coercion error policy: %r" % errors)
+    columns = dict((column, ([row[column] for row in rows], converter(type_)))
+            for column, type_ in coercions.iteritems())
+
+    if processes == 1 or len(rows) <= CHUNK_SIZE:
+        results = dict((column, coerce_column(values, convert, errors, 0,
+            column)) for column, (values, convert) in columns.iteritems())
+    else:
+        results = _coerce_parallel(columns, errors, processes)
+
+    failures = []
+    for column, (converted, column_failures) in sorted(results.iteritems()):
+        for row, value in izip(rows, converted):
+            row[column] = value
+        failures.extend(column_failures)
+    if failures and errors == 'collect':
+        raise CoercionError(sorted(failures))
@@ -0,0 +1,446 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Typed column storage.
+
+A collection given a schema keeps its data column-wise: typed columns are held
+in compact arrays (with a validity bitmap for nulls) instead of lists of boxed
+Python objects.
+"""
+
+from array import array
+from collections import MutableSequence
+from ctypes import memmove, sizeof
+from multiprocessing.sharedctypes import RawArray, typecode_to_type
+from datetime import date
+from itertools import imap, izip
+
+from datalib.coercion import parse_date
+
+
+class ColumnType(object):
+    """Storage type of a typed column.
+
+    Values are converted with parse before being stored in an array of given
+    typecode; load converts stored items back (None if stored items are the
+    values themselves).
+    """
+
+    def __init__(self, name, typecode, parse, load=None):
+        self.name = name
+        self.typecode = typecode
+        self.parse = parse
+        self.load = load
+
+    def __repr__(self):
+        return "<ColumnType %s>" % self.name
+
+
+def _parse_bool(value):
+    """Convert value to stored boolean.
+
+    >>> _parse_bool('false'), _parse_bool('1'), _parse_bool(0)
+    (0, 1, 0)
+    """
+    if isinstance(value, basestring):
+        value = value.strip().lower()
+        if value in ('true', 't', 'yes', 'y', '1'):
+            return 1
+        if value in ('false', 'f', 'no', 'n', '0', ''):
+            return 0
+        raise ValueError("invalid boolean: %r" % value)
+    return int(bool(value))
+
+
+def _parse_date(value):
+    """Convert ISO-8601 date (or date instance) to stored day ordinal.
+
+    >>> _parse_date('2010-06-01') == date(2010, 6, 1).toordinal()
+    True
+    """
+    return parse_date(value).toordinal()
+
+
+# array typecode 'l' is a C long, which is 64 bits on LP64 platforms.
+INT64 = ColumnType('int64', 'l', int)
+FLOAT64 = ColumnType('float64', 'd', float)
+BOOL = ColumnType('bool', 'b', _parse_bool, bool)
+DATE = ColumnType('date', 'l', _parse_date, date.fromordinal)
+
+COLUMN_TYPES = dict((t.name, t) for t in (INT64, FLOAT64, BOOL, DATE))
+
+
+# column types of arrays read in place, by typecode
+_ARRAY_TYPES = {'l': INT64, 'd': FLOAT64}
+
+
+def column_type(spec):
+    """Return ColumnType for given type or type name.
+
+    >>> column_type('float64') is FLOAT64
+    True
+    """
+    if isinstance(spec, ColumnType):
+        return spec
+    return COLUMN_TYPES[spec]
+
+
+def _all_valid(length):
+    """Return validity bitmap with first length bits set."""
+    bitmap = bytearray('\xff' * (length >> 3))
+    if length & 7:
+        bitmap.append((1 << (length & 7)) - 1)
+    return bitmap
+
+
+def _shared_copy(values, typecode):
+    """Return copy of array (or bytearray) values in shared memory."""
+    if not isinstance(values, array):
+        values = array(typecode, values)
+    shared = RawArray(typecode, len(values))
+    if values:
+        address, length = values.buffer_info()
+        memmove(shared, address, length * values.itemsize)
+    return shared
+
+
+class TypedColumn(object):
+    """Nullable column of a single type, stored in an array.
+
+    >>> c = TypedColumn(INT64, ['1', None, 3])
+    >>> list(c), c.null_count
+    ([1, None, 3], 1)
+    >>> c.values.itemsize
+    8
+    """
+
+    def __init__(self, type_, values=()):
+        self.type = type_
+        self.values = array(type_.typecode)
+        self.validity = bytearray()
+        self.null_count = 0
+        self.extend(values)
+
+    @classmethod
+    def wrap(cls, type_, values):
+        """Return column (without nulls) reading values in place.
+
+        values is an array, or ctypes array, of the items of type_.
+
+        >>> values = array('d', [1.5, 2.5])
+        >>> TypedColumn.wrap(FLOAT64, values).values is values
+        True
+        """
+        column = cls(type_)
+        column.values = values
+        column.validity = _all_valid(len(values))
+        return column
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        if not self.null_count:
+            if self.type.load is None:
+                return iter(self.values)
+            return imap(self.type.load, self.values)
+        return (self[idx] for idx in xrange(len(self.values)))
+
+    def __getitem__(self, idx):
+        if not self.validity[idx >> 3] & (1 << (idx & 7)):
+            return None
+        if self.type.load is None:
+            return self.values[idx]
+        return self.type.load(self.values[idx])
+
+    def __setitem__(self, idx, value):
+        valid = self.validity[idx >> 3] & (1 << (idx & 7))
+        if value is None:
+            self.values[idx] = 0
+            if valid:
+                self.validity[idx >> 3] &= ~(1 << (idx & 7))
+                self.null_count += 1
+        else:
+            self.values[idx] = self.type.parse(value)
+            if not valid:
+                self.validity[idx >> 3] |= 1 << (idx & 7)
+                self.null_count -= 1
+
+    def __repr__(self):
+        return "<TypedColumn %s, %s values>" % (self.type.name, len(self))
+
+    def append(self, value):
+        """Add value (None for null) to end of column."""
+        self._extend_parsed(self._parse((value,)))
+
+    def _parse(self, values):
+        """Return values parsed for storage (None for nulls), so bad values
+        fail before the column is changed."""
+        parse = self.type.parse
+        return [None if value is None else parse(value) for value in values]
+
+    def _extend_parsed(self, values):
+        """Add values returned by _parse to end of column."""
+        if not isinstance(self.values, array):
+            self._own()
+        for value in values:
+            idx = len(self.values)
+            if not idx & 7:
+                self.validity.append(0)
+            if value is None:
+                self.values.append(0)
+                self.null_count += 1
+            else:
+                self.values.append(value)
+                self.validity[idx >> 3] |= 1 << (idx & 7)
+
+    def _own(self):
+        """Copy values read in place from a buffer (or shared memory) into
+        an array of this column, so the column can be extended."""
+        values = array(self.type.typecode)
+        values.fromstring(buffer(self.values))
+        self.values = values
+        self.validity = bytearray(buffer(self.validity))
+
+    def extend(self, values):
+        """Add values to end of column (none of them if any fails)."""
+        self._extend_parsed(self._parse(values))
+
+    def slice(self, start, stop):
+        """Return values from position start up to stop."""
+        stop = min(stop, len(self.values))
+        if not self.null_count:
+            if self.type.load is None:
+                return self.values[start:stop]
+            return map(self.type.load, self.values[start:stop])
+        return [self[idx] for idx in xrange(start, stop)]
+
+    def share(self):
+        """Return copy of column with its buffers in shared memory.
+
+        Forked worker processes read a shared column without copying it.  A
+        shared column is read and updated in place, until it is extended
+        (which copies it out of shared memory).
+
+        >>> c = TypedColumn(FLOAT64, [1.5, None]).share()
+        >>> list(c), list(c.take([0]))
+        ([1.5, None], [1.5])
+        """
+        column = TypedColumn(self.type)
+        column.values = _shared_copy(self.values, self.type.typecode)
+        column.validity = _shared_copy(self.validity, 'B')
+        column.null_count = self.null_count
+        return column
+
+    def take(self, indices):
+        """Return new column of the values at given positions."""
+        column = TypedColumn(self.type)
+        if not self.null_count:
+            values = self.values
+            column.values = array(self.type.typecode,
+                    [values[idx] for idx in indices])
+            column.validity = _all_valid(len(column.values))
+        else:
+            column.extend(self[idx] for idx in indices)
+        return column
+
+    def valid_values(self):
+        """Return non-null values (the array itself, when possible)."""
+        if not self.null_count and self.type.load is None:
+            return self.values
+        return (value for value in self if value is not None)
+
+
+class _RowView(object):
+    """Row of a ColumnStore, reading and writing through to its columns."""
+
+    __slots__ = ('_columns', '_idx')
+
+    def __init__(self, columns, idx):
+        self._columns = columns
+        self._idx = idx
+
+    def __getitem__(self, col):
+        return self._columns[col][self._idx]
+
+    def __setitem__(self, col, value):
+        self._columns[col][self._idx] = value
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __iter__(self):
+        idx = self._idx
+        return (column[idx] for column in self._columns)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ColumnStore(MutableSequence):
+    """Column-wise storage presenting itself as a sequence of rows.
+
+    Columns with a type in schema (a mapping of column position to
+    ColumnType) are TypedColumns, others are plain lists.
+
+    >>> store = ColumnStore({0: INT64}, [('1', 'a'), ('2', 'b')])
+    >>> store[1]
+    [2, 'b']
+    >>> store.columns[0]
+    <TypedColumn int64, 2 values>
+    """
+
+    def __init__(self, schema, rows=()):
+        self.schema = dict((idx, column_type(type_))
+                for idx, type_ in schema.iteritems())
+        self.columns = []
+        self.extend(rows)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Return store of given columns, used in place where possible.
+
+        TypedColumns and lists are used as they are, and arrays of 'l' or
+        'd' items are read in place as int64 or float64 columns.  Other
+        sequences are copied into lists.
+
+        >>> store = ColumnStore.from_columns([array('l', [1, 2]), ['a', 'b']])
+        >>> store[1], store.schema
+        ([2, 'b'], {0: <ColumnType int64>})
+        """
+        store = cls({})
+        for idx, column in enumerate(columns):
+            if isinstance(column, array) and column.typecode in _ARRAY_TYPES:
+                column = TypedColumn.wrap(_ARRAY_TYPES[column.typecode],
+                        column)
+            elif not isinstance(column, (TypedColumn, list)):
+                column = list(column)
+            if isinstance(column, TypedColumn):
+                store.schema[idx] = column.type
+            store.columns.append(column)
+        return store
+
+    @classmethod
+    def from_buffer(cls, buffer, types):
+        """Return store reading columns of given types from buffer.
+
+        The buffer holds the items of each column (in native byte order)
+        one column after the other.  Writable buffers are read in place (like
+        shared columns, until a column is extended), others are copied.
+
+        >>> data = array('l', [1, 2]).tostring() + array('d', [.5, 1]).tostring()
+        >>> list(ColumnStore.from_buffer(bytearray(data), ['int64', 'float64']))
+        [[1, 0.5], [2, 1.0]]
+        """
+        types = [column_type(type_) for type_ in types]
+        item_types = [typecode_to_type[type_.typecode] for type_ in types]
+        length = len(buffer) // sum(sizeof(ctype) for ctype in item_types)
+
+        store = cls(dict(enumerate(types)))
+        offset = 0
+        for type_, ctype in zip(types, item_types):
+            try:
+                values = (ctype * length).from_buffer(buffer, offset)
+            except TypeError:
+                # read-only buffer
+                values = (ctype * length).from_buffer_copy(buffer, offset)
+            store.columns.append(TypedColumn.wrap(type_, values))
+            offset += sizeof(values)
+        return store
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('list index out of range')
+        return _RowView(self.columns, idx)
+
+    def __setitem__(self, idx, row):
+        if isinstance(row, _RowView) and row._columns is self.columns:
+            if row._idx == idx:
+                return
+        for column, value in izip(self.columns, list(row)):
+            column[idx] = value
+
+    def __delitem__(self, idx):
+        keep = range(len(self))
+        del keep[idx]
+        self.columns = self.take(keep).columns
+
+    def __repr__(self):
+        return "<ColumnStore %s rows, %s columns>" % (len(self),
+                len(self.columns))
+
+    def insert(self, idx, row):
+        if idx < len(self):
+            order = range(len(self))
+            self.append(row)
+            order.insert(idx, len(self) - 1)
+            self.columns = self.take(order).columns
+        else:
+            self.append(row)
+
+    def append(self, row):
+        self.extend((row,))
+
+    def extend(self, rows):
+        """Add rows to end of store; every value is parsed first, so rows
+        with a bad value leave the columns as they were."""
+        rows = list(rows)
+        if not rows:
+            return
+        columns = self.columns or [self._new_column(idx)
+                for idx in xrange(len(rows[0]))]
+        parsed = [column._parse(values) if isinstance(column, TypedColumn)
+                else values for column, values in izip(columns, izip(*rows))]
+        self.columns = columns
+        for column, values in izip(columns, parsed):
+            if isinstance(column, TypedColumn):
+                column._extend_parsed(values)
+            else:
+                column.extend(values)
+
+    def add_columns(self, values):
+        """Add a column per value, filled with that value."""
+        for value in values:
+            self.columns.append([value] * len(self))
+
+    def take(self, indices):
+        """Return new store of the rows at given positions."""
+        store = ColumnStore(self.schema)
+        for column in self.columns:
+            if isinstance(column, TypedColumn):
+                store.columns.append(column.take(indices))
+            else:
+                store.columns.append([column[idx] for idx in indices])
+        return store
+
+    def _new_column(self, idx):
+        """Return empty storage for column at given position."""
+        if idx in self.schema:
+            return TypedColumn(self.schema[idx])
+        return []
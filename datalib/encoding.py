@@ -0,0 +1,64 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Dictionary encoding of low-cardinality columns."""
+
+
+class Dictionary(object):
+    """Distinct values of a dictionary-encoded column.
+
+    Each distinct value is stored once and given an integer code.  Encoded
+    cells all reference the stored instance, so a column of a few distinct
+    strings costs one reference per cell, and comparing or hashing cells
+    (when filtering or grouping) works on the shared instances.
+
+    >>> d = Dictionary()
+    >>> d.encode('east') is d.encode(''.join(['ea', 'st']))
+    True
+    >>> d.code('east'), d.decode(0), len(d)
+    (0, 'east', 1)
+    """
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.encode(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return value in self.codes
+
+    def __repr__(self):
+        return "<Dictionary %s values>" % len(self.values)
+
+    def code(self, value):
+        """Return code of an encoded value."""
+        return self.codes[value]
+
+    def decode(self, code):
+        """Return value for given code."""
+        return self.values[code]
+
+    def encode(self, value):
+        """Return stored instance of value, adding value if it is new."""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.values[code]
@@ -16,10 +16,73 @@
 
 """Homogeneous data collections."""
 
+import re
 from code import compile_command
-
+from copy import copy
+from functools import partial
+from itertools import count, izip
+from string import Formatter
+
+from datalib.aggregates import aggregator
+from datalib.coercion import CoercionError, coerce_rows
+from datalib.columns import ColumnStore
+from datalib.encoding import Dictionary
+from datalib.memory import estimate_usage, memory_usage
+from datalib.selection import Selection
 from datalib.transaction import Transaction
 from datalib.records import Record, NamedRecord
+from datalib.serializers import write_csv, write_jsonl
+from datalib.spill import SpillPool, SpillStore
+from datalib.sketches import Sample
+
+
+# State tokens, see Collection._changed
+_STATES = count()
+
+
+class _Owned(object):
+    """Data a collection takes as its own storage, instead of copying its
+    rows."""
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _own_rows(rows):
+    """Return rows as a list of lists, copying them only if they are not."""
+    if isinstance(rows, list) and all(type(row) is list for row in rows):
+        return rows
+    return map(list, rows)
+
+
+def _calculation_references(calculation):
+    """Return positions of the columns read by a calculation (with its
+    place-holders replaced by row references).
+
+    >>> sorted(_calculation_references('r[0] * r[12] + r[0]'))
+    [0, 12]
+    """
+    return set(int(idx) for idx in re.findall(r'\br\[(\d+)\]', calculation))
+
+
+def _format_references(fmt):
+    """Return positions of the columns read by a format string.
+
+    >>> sorted(_format_references('{0.real}, {2[0]}'))
+    [0, 2]
+    >>> sorted(_format_references('{} and {}'))
+    [0, 1]
+    """
+    references, auto = set(), count()
+    for text, field, spec, conversion in Formatter().parse(fmt):
+        if field is None:
+            continue
+        field = re.split(r'[.[]', field, 1)[0]
+        if not field:
+            references.add(next(auto))
+        elif field.isdigit():
+            references.add(int(field))
+    return references
 
 
 class Collection(object):
@@ -33,12 +96,38 @@ class Collection(object):
     """
 
     def __init__(self, data, **kwargs):
-        self.data = [list(x) for x in data]
-        self.width = 0 if not self.data else len(self.data[0])
+        if isinstance(data, _Owned):
+            if kwargs.get('spill'):
+                raise ValueError("rows taken in place are not spilled")
+            self.data = data.data
+        elif kwargs.get('spill'):
+            self._check_spill(**kwargs)
+            self.data = SpillStore(SpillPool(kwargs['memory_budget']),
+                    (list(x) for x in data))
+        else:
+            self.data = [list(x) for x in data]
+        if self.data:
+            self.width = len(self.data[0])
+        else:
+            self.width = len(getattr(self, 'names', ()))
         self.transaction = Transaction(self)
 
         # State vars
         self._child_collections = {}
+        self._group_index = {}
+        self._group_states = {}
+        self._sample_slots = {}
+        self._coercions = {}
+        self._coerce_errors = 'strict'
+        self._coerce_processes = 1
+        self.coercion_errors = []
+        self._dictionaries = {}
+        self._schema = {}
+        if isinstance(self.data, ColumnStore):
+            self._schema = dict(self.data.schema)
+        self._state = next(_STATES)
+        self._shared = False
+        self.memory_budget = kwargs.get('memory_budget')
 
         # Add filters
         def _common_kwarg_handling():
@@ -47,8 +136,49 @@ class Collection(object):
                     self.filter(filter_fn)
             if 'group' in kwargs:
                 self.group(kwargs['group'])
+            if 'aggregate' in kwargs:
+                self.aggregate(kwargs['aggregate'])
 
         self._handle_kwargs(_common_kwarg_handling, **kwargs)
+        self.transaction.cache = kwargs.get('cache')
+
+
+    @classmethod
+    def from_rows(cls, rows, **kwargs):
+        """Return collection taking ownership of rows.
+
+        A list of lists is stored as it is, so changes to the collection
+        change those lists.  Other rows are converted to lists in one pass.
+
+        >>> rows = [[1, 2], [3, 4]]
+        >>> Collection.from_rows(rows).data is rows
+        True
+        """
+        return cls(_Owned(_own_rows(rows)), **kwargs)
+
+
+    @classmethod
+    def from_columns(cls, columns, **kwargs):
+        """Return collection stored column-wise in given columns.
+
+        See datalib.columns.ColumnStore.from_columns for the columns read in
+        place.
+
+        >>> from array import array
+        >>> col = Collection.from_columns([['a', 'b'], array('l', [1, 2])])
+        >>> list(col[1]), col.column(1).values
+        (['b', 2], array('l', [1, 2]))
+        """
+        return cls(_Owned(ColumnStore.from_columns(columns)), **kwargs)
+
+
+    @classmethod
+    def from_buffer(cls, buffer, types, **kwargs):
+        """Return collection reading columns of given types from buffer.
+
+        See datalib.columns.ColumnStore.from_buffer for the buffer layout.
+        """
+        return cls(_Owned(ColumnStore.from_buffer(buffer, types)), **kwargs)
 
 
     def __len__(self):
@@ -57,18 +187,11 @@ class Collection(object):
 
     def __iter__(self):
         for idx, record in enumerate(self.data):
-            if idx in self._child_collections:
-                children = self._child_collections[idx]
-            else:
-                children = None
-            yield Record(record, children)
+            yield self._record(record, self._load_children(idx))
 
 
     def __getitem__(self, key):
-        if key in self._child_collections:
-            return Record(self.data[key], self._child_collections[key])
-        else:
-            return Record(self.data[key])
+        return self._record(self.data[key], self._load_children(key))
 
 
     def __enter__(self):
@@ -106,22 +229,128 @@ class Collection(object):
         def _do_format(row, collection):
             return fmt.format(*row)
 
+        _do_format.references = _format_references(fmt)
         self.transaction.add('new_cols', _do_format)
 
 
     def add_calculated_column(self, calculation):
-        """Add new column whose value is the result of the given calculation."""
+        """Add new column whose value is the result of the given calculation.
+
+        Calculations may use other new columns of the same transaction, in
+        any order; columns using each other are refused.
+
+        >>> col = Collection([(1, 2)])
+        >>> with col:
+        ...     col.add_calculated_column('{3} * 10')
+        ...     col.add_calculated_column('{0} + {1}')
+        >>> list(col[0])
+        [1, 2, 30, 3]
+        """
         # replace place-holders with dictionary refs
         calculation = calculation.replace('{', 'r[').replace('}', ']')
 
         # create new function and return
         exec '_do_calc = lambda r, c: ' + calculation
+        _do_calc.references = _calculation_references(calculation)
         self.transaction.add('new_cols', _do_calc)
 
 
+    def aggregate(self, aggregations):
+        """Aggregate columns of each group into its group row.
+
+        aggregations maps columns to aggregates from datalib.aggregates (or to
+        plain functions, which are given the list of column values).  Null
+        (None) values are left out of every aggregate.  An ungrouped
+        collection is aggregated into a single row.
+
+        >>> from datalib.aggregates import Sum
+        >>> col = Collection([('a', 1), ('a', 2), ('b', 5)], group=[0])
+        >>> col.aggregate({1: Sum})
+        >>> [list(row) for row in col]
+        [['a', 3], ['b', 5]]
+        """
+        for column, spec in aggregations.iteritems():
+            self.transaction.add('aggregate',
+                    (self._column_index(column), aggregator(spec)))
+
+
+    def append(self, rows):
+        """Add rows, running only the new rows through the coercions and
+        committed transactions of this collection.
+
+        >>> col = Collection([(1, 2)], calculated_columns=('{0} + {1}',))
+        >>> col.append([(3, 4), (5, 6)])
+        >>> [list(row) for row in col]
+        [[1, 2, 3], [3, 4, 7], [5, 6, 11]]
+        """
+        rows = [list(x) for x in rows]
+        self._coerce(rows)
+        self._encode(rows)
+        self.transaction.append(rows)
+
+
+    def column(self, column):
+        """Return values of given column.
+
+        Columns typed by the collection schema are returned as their
+        TypedColumn, so vectorized code can use the underlying array.
+
+        >>> col = Collection([(1, 2), (3, 4)], schema={1: 'int64'})
+        >>> col.column(1).values
+        array('l', [2, 4])
+        >>> col.column(0)
+        [1, 3]
+        """
+        idx = self._column_index(column)
+        self._compact()
+        if isinstance(self.data, ColumnStore):
+            return self.data.columns[idx]
+        return [row[idx] for row in self.data]
+
+
+    def copy(self):
+        """Return collection sharing the rows and state of this one.
+
+        Copying is cheap: the state is only copied when either collection is
+        next changed.  Transactions committed on copies of an unchanged
+        collection with a transaction cache (see datalib.cache) are only run
+        once.
+
+        >>> from datalib.cache import TransactionCache
+        >>> col = Collection([(1, 2), (3, 4)], cache=TransactionCache())
+        >>> for i in range(3):
+        ...     view = col.copy()
+        ...     view.filter(lambda r: r[0] > 1)
+        >>> col.transaction.cache
+        <TransactionCache 1 entries, 2 hits, 1 misses>
+        >>> len(view), len(col)
+        (1, 2)
+        """
+        clone = copy(self)
+        if self._child_collections:
+            clone._child_collections = self._child_collections.share(clone)
+        if hasattr(self, 'names'):
+            clone.names = list(self.names)
+        clone.transaction = Transaction(clone)
+        clone.transaction.cache = self.transaction.cache
+        clone.transaction.pipeline = self.transaction.copy_pipeline()
+        self._shared = clone._shared = True
+        return clone
+
+
+    def dictionary(self, column):
+        """Return lookup table of a dictionary-encoded column.
+
+        >>> col = Collection([('a', 1), ('b', 2), ('a', 3)], encode=[0])
+        >>> col.dictionary(0).values
+        ['a', 'b']
+        """
+        return self._dictionaries[self._column_index(column)]
+
+
     def factory(self, data):
         """Returns method to generate similar collection instance."""
-        return type(self)(data)
+        return type(self)(data, schema=self._schema)
 
 
     def filter(self, fn):
@@ -130,19 +359,251 @@ class Collection(object):
 
 
     def group(self, groupby_list):
-        """Group rows with the same values for the given column positions."""
+        """Group rows with the same values for the given column positions.
+
+        Each position after the first adds a level to the hierarchy: the
+        children of each group are grouped on the remaining positions, and
+        aggregates are applied at every level.
+
+        >>> from datalib.aggregates import Sum
+        >>> col = Collection([('a', 'x', 1), ('b', 'x', 2), ('a', 'y', 3),
+        ...     ('a', 'x', 4)], group=[0, 1], aggregate={2: Sum})
+        >>> [list(row) for row in col]
+        [['a', None, 8], ['b', None, 2]]
+        >>> [list(row) for row in col[0].children]
+        [[None, 'x', 5], [None, 'y', 3]]
+        """
         for groupby in groupby_list:
             self.transaction.add('group', groupby)
 
 
+    def memory_usage(self, deep=True):
+        """Return bytes used by collection, broken down by column, child
+        collections and indexes.
+
+        See datalib.memory.memory_usage for the report layout.
+        """
+        return memory_usage(self, deep)
+
+
+    def sample(self, size, seed=None):
+        """Keep a uniform random sample of rows: size rows when size is an
+        integer, or each row with probability size when it is a float.
+
+        The sample is kept up to date as rows are appended, in one pass and
+        without holding more than the sampled rows.
+
+        >>> col = Collection([(x,) for x in range(100)])
+        >>> col.transaction.begin()
+        >>> col.sample(10, seed=1)
+        >>> col.transaction.commit()
+        >>> len(col)
+        10
+        """
+        self.transaction.add('sample', Sample(size, seed))
+
+
+    def to_csv(self, target, columns=None, **kwargs):
+        """Write rows to target (a path or file object) as CSV.
+
+        See datalib.serializers.write_csv for the supported options.
+        """
+        write_csv(self, target, columns, **kwargs)
+
+
+    def to_jsonl(self, target, columns=None, **kwargs):
+        """Write rows to target (a path or file object) as JSON Lines.
+
+        See datalib.serializers.write_jsonl for the supported options.
+        """
+        write_jsonl(self, target, columns, **kwargs)
+
+
+    def _changed(self):
+        """Give collection a new state token after it changed."""
+        self._state = next(_STATES)
+
+
+    def _snapshot(self):
+        """Return state of collection, to be shared with the collection."""
+        self._shared = True
+        return dict(data=self.data, width=self.width, _state=self._state,
+                _child_collections=self._shared_children(),
+                _group_index=self._group_index,
+                _group_states=self._group_states,
+                _sample_slots=self._sample_slots)
+
+
+    def _restore(self, snapshot):
+        """Take shared state from snapshot."""
+        self.__dict__.update(snapshot)
+        self._child_collections = self._shared_children()
+        self._shared = True
+
+
+    def _shared_children(self):
+        """Return child collections of this collection for the holder of a
+        copy of its state (children are built into the dict of their
+        holder, so holders must not share it)."""
+        if not self._child_collections:
+            return self._child_collections
+        return self._child_collections.share(self)
+
+
+    def _unshare(self):
+        """Copy state shared with other collections (or a transaction
+        cache) before collection is changed."""
+        if not self._shared:
+            return
+        self._shared = False
+
+        if isinstance(self.data, Selection) and \
+                isinstance(self.data.data, (ColumnStore, SpillStore)):
+            self.data = self.data.compact()
+        elif isinstance(self.data, (ColumnStore, SpillStore)):
+            self.data = self.data.take(xrange(len(self.data)))
+        else:
+            self.data = [list(row) for row in self.data]
+        if self._child_collections:
+            self._child_collections = self._child_collections.copy(self)
+        self._group_index = dict(self._group_index)
+        self._sample_slots = dict(self._sample_slots)
+        self._group_states = dict((idx, dict((instruction, copy(state))
+            for instruction, state in states.iteritems()))
+            for idx, states in self._group_states.iteritems())
+        self._dictionaries = dict((idx, Dictionary(dictionary.values))
+                for idx, dictionary in self._dictionaries.iteritems())
+
+
+    def _record(self, row, load_children=None):
+        """Wrap stored row in record type of this collection."""
+        return Record(row, load_children=load_children)
+
+
+    def _check_memory(self):
+        """Release memory held by collection if it is over its memory
+        budget (a soft limit in bytes, given as memory_budget).
+
+        Usage is estimated from a sample of rows (see
+        datalib.memory.estimate_usage), and only measured at all when there
+        is a selection to release."""
+        if self.memory_budget is None or self._shared or \
+                not isinstance(self.data, Selection):
+            return
+        if estimate_usage(self) > self.memory_budget:
+            self._reclaim()
+
+
+    def _compact(self):
+        """Copy out rows selected by filters from column-wise storage, so
+        its columns can be read directly."""
+        if isinstance(self.data, Selection) and \
+                isinstance(self.data.data, ColumnStore):
+            self.data = self.data.compact()
+
+
+    def _reclaim(self):
+        """Release rows dropped by filters but still held by a selection."""
+        if isinstance(self.data, Selection) and not self._shared:
+            self.data = self.data.compact()
+
+
+    def _factory_rows(self, rows):
+        """Return similar collection of given stored rows.
+
+        Rows are copied, unless they are a ColumnStore (which is only ever
+        taken from a collection as a copy).
+        """
+        if isinstance(rows, ColumnStore):
+            return self._from_data(ColumnStore.from_columns(rows.columns))
+        return self._from_data(map(list, rows))
+
+
+    def _from_data(self, data):
+        """Return similar collection owning data."""
+        return type(self)(_Owned(data))
+
+
+    def _load_children(self, idx):
+        """Return function loading child collection of row at idx, if any."""
+        if idx in self._child_collections:
+            return partial(self._child_collections.__getitem__, idx)
+
+
+    def _check_spill(self, **kwargs):
+        """Check options of a collection spilling rows to disk."""
+        if kwargs.get('memory_budget') is None:
+            raise ValueError("spilling needs a memory_budget")
+        if kwargs.get('schema'):
+            raise ValueError("spilled rows are not stored by schema")
+
+
+    def _column_index(self, column):
+        """Return position of given column."""
+        return column
+
+
+    def _width_known(self):
+        """Return whether width counts the columns of the rows (it is not
+        known before an unnamed collection holds rows)."""
+        return bool(len(self.data))
+
+
+    def _coerce(self, rows):
+        """Apply column coercions to given rows in place.
+
+        See datalib.coercion.coerce_rows for the error policies
+        (coerce_errors) and parallel coercion (coerce_processes).  Under the
+        collect policy the rows are kept, and the (row, column, value,
+        message) of their failing cells are left in coercion_errors, with
+        rows counted from the first of the given rows.
+
+        >>> col = Collection([('1',), ('x',)], coerce={0: int},
+        ...         coerce_errors='collect')
+        >>> [list(row) for row in col]
+        [[1], [None]]
+        >>> [error[:3] for error in col.coercion_errors]
+        [(1, 0, 'x')]
+        """
+        self.coercion_errors = []
+        if not self._coercions:
+            return
+        try:
+            coerce_rows(rows, self._coercions, self._coerce_errors,
+                    self._coerce_processes)
+        except CoercionError, ex:
+            if self._coerce_errors != 'collect':
+                raise
+            self.coercion_errors = ex.errors
+
+
+    def _encode(self, rows):
+        """Replace cells of dictionary-encoded columns in given rows with the
+        instances stored in their dictionaries."""
+        for idx, dictionary in self._dictionaries.iteritems():
+            encode = dictionary.encode
+            for row in rows:
+                row[idx] = encode(row[idx])
+
+
     def _handle_kwargs(self, common_kwarg_handling, **kwargs):
         """Handle kwargs passed in on __init__."""
         with self:
             common_kwarg_handling()
             if 'coerce' in kwargs:
-                for i in xrange(len(self.data)):
-                    for idx, type_ in kwargs['coerce'].iteritems():
-                        self.data[i][idx] = type_(self.data[i][idx])
+                self._coercions = dict((self._column_index(col), type_)
+                        for col, type_ in kwargs['coerce'].iteritems())
+                self._coerce_errors = kwargs.get('coerce_errors', 'strict')
+                self._coerce_processes = kwargs.get('coerce_processes', 1)
+                self._coerce(self.data)
+            if 'encode' in kwargs:
+                self._dictionaries = dict((self._column_index(col),
+                    Dictionary()) for col in kwargs['encode'])
+                self._encode(self.data)
+            if kwargs.get('schema'):
+                self._schema.update((self._column_index(col), type_)
+                        for col, type_ in kwargs['schema'].iteritems())
+                self.data = ColumnStore(self._schema, self.data)
             if 'formatted_columns' in kwargs:
                 for col in kwargs['formatted_columns']:
                     self.add_formatted_column(col)
@@ -166,6 +627,35 @@ class NamedCollection(Collection):
         super(NamedCollection, self).__init__(data, **kwargs)
 
 
+    @classmethod
+    def from_rows(cls, names, rows, **kwargs):
+        """Return named collection taking ownership of rows.
+
+        See Collection.from_rows.
+        """
+        return cls(names, _Owned(_own_rows(rows)), **kwargs)
+
+
+    @classmethod
+    def from_columns(cls, names, columns, **kwargs):
+        """Return named collection stored column-wise in given columns.
+
+        See Collection.from_columns.
+        """
+        return cls(names, _Owned(ColumnStore.from_columns(columns)), **kwargs)
+
+
+    @classmethod
+    def from_buffer(cls, names, buffer, types, **kwargs):
+        """Return named collection reading columns of given types from
+        buffer.
+
+        See Collection.from_buffer.
+        """
+        return cls(names, _Owned(ColumnStore.from_buffer(buffer, types)),
+                **kwargs)
+
+
     def __repr__(self):
         if self.data:
             return ("<NamedCollection %s rows, %s columns>" 
@@ -181,20 +671,7 @@ class NamedCollection(Collection):
         >>> list(col.__iter__())[0]
         {'a': 1, 'b': 2}
         """
-        for idx, record in enumerate(self.data):
-            if idx in self._child_collections:
-                children = self._child_collections=[idx]
-            else:
-                children = None
-            yield NamedRecord(dict(zip(self.names, record)), children)
-
-
-    def __getitem__(self, key):
-        record = dict(zip(self.names, self.data[key]))
-        if key in self._child_collections:
-            return NamedRecord(record, self._child_collections[key])
-        else:
-            return NamedRecord(record)
+        return super(NamedCollection, self).__iter__()
 
     
     def add_formatted_column(self, name, fmt):
@@ -212,7 +689,8 @@ class NamedCollection(Collection):
         def _do_format(row, collection):
             return fmt.format(*row)
 
-        self.transaction.add('new_cols', _do_format)
+        _do_format.references = _format_references(fmt)
+        self._add_named_column(_do_format)
 
 
     def add_calculated_column(self, name, calculation):
@@ -224,13 +702,48 @@ class NamedCollection(Collection):
         self.names.append(name)
 
         exec '_do_calc = lambda r, c: ' + calculation
-        self.transaction.add('new_cols', _do_calc)
+        _do_calc.references = _calculation_references(calculation)
+        self._add_named_column(_do_calc)
+
+
+    def _add_named_column(self, instruction):
+        """Add new column instruction for the name last appended to names;
+        the name is removed again if the column is rejected."""
+        try:
+            self.transaction.add('new_cols', instruction)
+        except:
+            self.names.pop()
+            raise
 
 
     def factory(self, data):
         """Generate similar collection"""
-        return type(self)(self.names,
-                ((x[y] for y in self.names) for x in data))
+        schema = dict((self.names[idx], type_)
+                for idx, type_ in self._schema.iteritems())
+        names = self.names
+        return type(self).from_rows(names,
+                [[x[y] for y in names] for x in data], schema=schema)
+
+
+    def _from_data(self, data):
+        """Return similar collection owning data."""
+        return type(self)(self.names, _Owned(data))
+
+
+    def _record(self, row, load_children=None):
+        """Wrap stored row in a name-keyed record."""
+        return NamedRecord(izip(self.names, row), load_children=load_children)
+
+
+    def _column_index(self, column):
+        """Return position of named column."""
+        return self.names.index(column)
+
+
+    def _width_known(self):
+        """Return whether width counts the columns of the rows (always, for
+        they are named)."""
+        return True
 
 
     def _handle_kwargs(self, common_kwarg_handling, **kwargs):
@@ -238,10 +751,19 @@ class NamedCollection(Collection):
         with self:
             common_kwarg_handling()
             if 'coerce' in kwargs:
-                for idx, type_ in kwargs['coerce'].iteritems():
-                    idx = self.names.index(idx)
-                    for row in self.data:
-                        row[idx] = type_(row[idx])
+                self._coercions = dict((self._column_index(col), type_)
+                        for col, type_ in kwargs['coerce'].iteritems())
+                self._coerce_errors = kwargs.get('coerce_errors', 'strict')
+                self._coerce_processes = kwargs.get('coerce_processes', 1)
+                self._coerce(self.data)
+            if 'encode' in kwargs:
+                self._dictionaries = dict((self._column_index(col),
+                    Dictionary()) for col in kwargs['encode'])
+                self._encode(self.data)
+            if kwargs.get('schema'):
+                self._schema.update((self._column_index(col), type_)
+                        for col, type_ in kwargs['schema'].iteritems())
+                self.data = ColumnStore(self._schema, self.data)
             if 'formatted_columns' in kwargs:
                 for col in kwargs['formatted_columns']:
                     self.add_formatted_column(*col)
@@ -0,0 +1,198 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Memory accounting.
+
+Sizes are measured with sys.getsizeof.  Values referenced from several
+places (such as dictionary encoded strings) are counted once per report.
+"""
+
+from collections import OrderedDict
+from struct import calcsize
+from sys import getsizeof
+
+from datalib.columns import ColumnStore, TypedColumn
+from datalib.selection import Selection
+from datalib.spill import SpillStore
+from datalib.transaction import PlaceHolderColumn, _PendingGroup
+
+
+# size of a reference held by a row or column list
+POINTER_SIZE = calcsize('P')
+
+# rows measured by estimate_usage
+SAMPLE_SIZE = 1000
+
+
+def _values_size(values, deep, seen):
+    """Return size of values not yet seen (0 unless deep)."""
+    if not deep:
+        return 0
+    size = 0
+    for value in values:
+        if id(value) not in seen:
+            seen.add(id(value))
+            size += getsizeof(value)
+    return size
+
+
+def _rows_usage(data, deep, seen):
+    """Return (column sizes, row container size, placeholder size) of rows,
+    stored as lists of rows or column-wise (only rows in memory are counted
+    for spilled rows)."""
+    if isinstance(data, ColumnStore):
+        columns, placeholders = [], 0
+        for column in data.columns:
+            if isinstance(column, TypedColumn):
+                columns.append(getsizeof(column.values) +
+                        getsizeof(column.validity))
+            elif column and column[0] is PlaceHolderColumn:
+                columns.append(0)
+                placeholders += getsizeof(column)
+            else:
+                columns.append(getsizeof(column) +
+                        _values_size(column, deep, seen))
+        return columns, getsizeof(data.columns), placeholders
+
+    if isinstance(data, SpillStore):
+        data = data.hot_rows()
+    rows = getsizeof(data)
+    columns = []
+    placeholders = 0
+    for row in data:
+        # rows padded for new columns may be longer than rows left out by
+        # a filter, so each row is measured by its own length
+        if len(row) > len(columns):
+            columns.extend([0] * (len(row) - len(columns)))
+        rows += getsizeof(row) - POINTER_SIZE * len(row)
+        for idx, value in enumerate(row):
+            if value is PlaceHolderColumn:
+                placeholders += POINTER_SIZE
+                continue
+            columns[idx] += POINTER_SIZE
+            if deep and id(value) not in seen:
+                seen.add(id(value))
+                columns[idx] += getsizeof(value)
+    return columns, rows, placeholders
+
+
+def estimate_usage(collection, sample_size=SAMPLE_SIZE):
+    """Return estimated total bytes held by the rows of collection.
+
+    Values are measured on (at most) sample_size evenly spaced rows and
+    scaled to all rows, so the estimate takes about the same time for any
+    number of rows.  Indexes and child collections are not counted.
+
+    >>> from datalib.hcollections import Collection
+    >>> col = Collection([(x, 'a' * x) for x in range(100)])
+    >>> abs(estimate_usage(col, 10) - memory_usage(col)['total']) < 1000
+    True
+    """
+    data = collection.data
+    size = 0
+    if isinstance(data, Selection):
+        size += getsizeof(data) + getsizeof(data.positions)
+        data = data.data
+    if isinstance(data, SpillStore):
+        data = data.hot_rows()
+    if not len(data):
+        return size + getsizeof(data)
+    step = max(1, len(data) // sample_size)
+    scale = float(len(data)) / len(xrange(0, len(data), step))
+
+    if isinstance(data, ColumnStore):
+        size += getsizeof(data.columns)
+        for column in data.columns:
+            if isinstance(column, TypedColumn):
+                size += getsizeof(column.values) + getsizeof(column.validity)
+            elif column and column[0] is PlaceHolderColumn:
+                size += getsizeof(column)
+            else:
+                size += getsizeof(column) + scale * _values_size(
+                        column[::step], True, set())
+        return int(size)
+
+    sample = data[::step]
+    columns, rows, placeholders = _rows_usage(sample, True, set())
+    size += getsizeof(data) + scale * (sum(columns) + placeholders +
+            rows - getsizeof(sample))
+    return int(size)
+
+
+def _total(usage):
+    """Return total bytes of a memory report."""
+    return sum(sum(value.itervalues()) if isinstance(value, dict) else value
+            for key, value in usage.iteritems() if key != 'total')
+
+
+def memory_usage(collection, deep=True, seen=None):
+    """Return bytes used by collection, by part.
+
+    The report has the bytes held by each column (keyed by column name, or
+    position for unnamed collections), and by: row containers ('rows'),
+    PlaceHolderColumn padding of columns being added ('placeholders'), the
+    positions of rows selected by filters ('selection'), group and encoding
+    indexes ('index') and child collections ('children').  Filtered out rows
+    still held by a selection are included.  Without deep, the values
+    referenced by rows are not counted.
+
+    >>> from datalib.hcollections import Collection
+    >>> usage = memory_usage(Collection([(1, 'a'), (2, 'b')]))
+    >>> usage.keys()
+    ['columns', 'rows', 'placeholders', 'selection', 'index', 'children', 'total']
+    >>> usage['total'] == sum(usage['columns'].values()) + usage['rows']
+    True
+    """
+    if seen is None:
+        seen = set()
+    data = collection.data
+    selection = 0
+    if isinstance(data, Selection):
+        selection = getsizeof(data) + getsizeof(data.positions)
+        data = data.data
+    columns, rows, placeholders = _rows_usage(data, deep, seen)
+    names = getattr(collection, 'names', None) or range(len(columns))
+
+    index = 0
+    if collection._group_index:
+        index += getsizeof(collection._group_index)
+        index += getsizeof(collection._group_states)
+        for states in collection._group_states.itervalues():
+            index += getsizeof(states)
+            index += _values_size(states.itervalues(), deep, seen)
+    for dictionary in collection._dictionaries.itervalues():
+        index += getsizeof(dictionary.values) + getsizeof(dictionary.codes)
+
+    children = 0
+    if collection._child_collections:
+        children += getsizeof(collection._child_collections)
+        for child in dict.itervalues(collection._child_collections):
+            if isinstance(child, _PendingGroup):
+                columns_, rows_, placeholders_ = _rows_usage(child.rows,
+                        deep, seen)
+                children += sum(columns_) + rows_ + placeholders_
+            else:
+                children += memory_usage(child, deep, seen)['total']
+
+    usage = OrderedDict([
+        ('columns', OrderedDict(zip(names, columns))),
+        ('rows', rows),
+        ('placeholders', placeholders),
+        ('selection', selection),
+        ('index', index),
+        ('children', children)])
+    usage['total'] = _total(usage)
+    return usage
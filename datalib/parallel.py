@@ -0,0 +1,221 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Partitioned collections and multi-process map-reduce.
+
+A PartitionedCollection splits the rows of a collection on a key.  Typed
+columns of each partition are held in shared memory, other columns in plain
+lists.  Worker processes are forked after the partitions are built, so they
+read their partition in place: rows are never pickled, only the partial
+results of each worker are sent back.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+from datalib.aggregates import aggregator
+from datalib.columns import ColumnStore, TypedColumn
+
+
+# Partitioned collection and job of the running map-reduce, inherited by the
+# forked worker processes.
+_JOB = None
+
+
+def _run_partition(idx):
+    """Run current job on a partition (in a worker process)."""
+    partitioned, job = _JOB
+    return partitioned._run(idx, job)
+
+
+class PartitionedCollection(object):
+    """Collection rows split into partitions on a key column.
+
+    by='hash' places rows by the hash of their key.  by='range' places them
+    by sorted key ranges; bounds (the first key of every partition after the
+    first) are taken from the keys when not given.
+
+    >>> from datalib.aggregates import Sum
+    >>> from datalib.hcollections import Collection
+    >>> col = Collection([('a', 1), ('b', 2), ('a', 3)], schema={1: 'int64'})
+    >>> parts = PartitionedCollection(col, 0, partitions=2)
+    >>> result = parts.map_reduce(group=[0], aggregate={1: Sum}, processes=1)
+    >>> sorted(list(row) for row in result)
+    [['a', 4], ['b', 2]]
+    """
+
+    def __init__(self, collection, key, partitions=None, by='hash',
+            bounds=None):
+        self.collection = collection
+        self.key = key
+        self.partitions = partitions or cpu_count()
+
+        collection._compact()
+        data = collection.data
+        key_idx = collection._column_index(key)
+        if isinstance(data, ColumnStore):
+            keys = list(data.columns[key_idx])
+        else:
+            keys = [row[key_idx] for row in data]
+
+        if by == 'hash':
+            places = [hash(value) % self.partitions for value in keys]
+        elif by == 'range':
+            if bounds is None:
+                bounds = self._range_bounds(keys)
+            self.bounds = list(bounds)
+            places = [bisect_right(self.bounds, value) for value in keys]
+            self.partitions = len(self.bounds) + 1
+        else:
+            raise ValueError("unknown partitioning: %r" % by)
+
+        positions = [[] for idx in xrange(self.partitions)]
+        for idx, place in enumerate(places):
+            positions[place].append(idx)
+        self._columns = [self._partition_columns(data, p) for p in positions]
+
+
+    def __len__(self):
+        return sum(len(self.partition(idx)) for idx in xrange(self.partitions))
+
+
+    def __repr__(self):
+        return "<PartitionedCollection %s partitions>" % self.partitions
+
+
+    def partition(self, idx):
+        """Return collection reading partition idx in place."""
+        store = ColumnStore(self.collection._schema)
+        store.columns = list(self._columns[idx])
+        partition = self.collection.factory([])
+        partition.data = store
+        partition.width = len(store.columns)
+        return partition
+
+
+    def map_reduce(self, filter=(), calculated_columns=(), group=(),
+            aggregate=None, processes=None):
+        """Run filters, calculated columns, grouping and aggregates on every
+        partition and merge the partial results.
+
+        Calculated columns are added to rows before they are grouped.  With
+        aggregates, returns a collection of one row per distinct combination
+        of the group columns (or a single row, if there are none); otherwise
+        the filtered rows of every partition.  The job runs in a pool of
+        forked worker processes (in this process if processes is 1).
+        """
+        global _JOB
+
+        aggregates = [(column, aggregator(spec))
+                for column, spec in (aggregate or {}).iteritems()]
+        job = dict(filter=filter, calculated_columns=calculated_columns,
+                group=group, aggregates=aggregates)
+
+        if processes == 1:
+            results = [self._run(idx, job) for idx in xrange(self.partitions)]
+        else:
+            _JOB = (self, job)
+            pool = Pool(processes or self.partitions)
+            try:
+                results = pool.map(_run_partition, range(self.partitions))
+            finally:
+                pool.close()
+                pool.join()
+                _JOB = None
+
+        result = self.collection.factory([])
+        result.width = self.collection.width
+        self._add_columns(result, calculated_columns)
+        if not aggregates:
+            return result.factory(result._record(row)
+                    for rows in results for row in rows)
+
+        merged = OrderedDict()
+        for partial in results:
+            for key, states in partial:
+                if key in merged:
+                    merged[key] = [agg.merge(state, other) for (column, agg),
+                            state, other in zip(aggregates, merged[key], states)]
+                else:
+                    merged[key] = states
+
+        group_idx = [result._column_index(column) for column in group]
+        records = []
+        for key, states in merged.iteritems():
+            record = [None] * result.width
+            for idx, value in zip(group_idx, key or ()):
+                record[idx] = value
+            for (column, agg), state in zip(aggregates, states):
+                record[result._column_index(column)] = agg.final(state)
+            records.append(record)
+        return result.factory(result._record(row) for row in records)
+
+
+    def _add_columns(self, collection, calculated_columns):
+        """Add calculated columns to collection."""
+        for column in calculated_columns:
+            if hasattr(collection, 'names'):
+                collection.add_calculated_column(*column)
+            else:
+                collection.add_calculated_column(column)
+
+
+    def _run(self, idx, job):
+        """Run job on partition idx and return its partial result."""
+        collection = self.partition(idx)
+        with collection:
+            for fn in job['filter']:
+                collection.filter(fn)
+            self._add_columns(collection, job['calculated_columns'])
+        if not job['aggregates']:
+            return [list(row) for row in collection.data]
+
+        group = job['group']
+        instructions = [(collection._column_index(column), agg)
+                for column, agg in job['aggregates']]
+        with collection:
+            if group:
+                collection.group([lambda record: tuple(record[column]
+                    for column in group)])
+            for instruction in instructions:
+                collection.transaction.add('aggregate', instruction)
+
+        states = collection._group_states
+        return [(key, [states[idx][instruction]
+                for instruction in instructions])
+            for key, idx in collection._group_index.iteritems()]
+
+
+    def _range_bounds(self, keys):
+        """Return bounds splitting sorted keys into even partitions."""
+        if not keys:
+            return []
+        keys = sorted(keys)
+        step = float(len(keys)) / self.partitions
+        return [keys[int(step * idx)] for idx in xrange(1, self.partitions)]
+
+
+    def _partition_columns(self, data, positions):
+        """Return columns of the rows at positions, typed columns in
+        shared memory."""
+        if isinstance(data, ColumnStore):
+            return [column.take(positions).share()
+                    if isinstance(column, TypedColumn)
+                    else [column[idx] for idx in positions]
+                    for column in data.columns]
+        width = self.collection.width
+        return [[data[idx][col] for idx in positions] for col in xrange(width)]
@@ -16,7 +16,22 @@
 """Collection records."""
 
 
-class Record(list):
+class _HasChildren(object):
+    """Record children, which may be loaded on first access."""
+
+    @property
+    def children(self):
+        """Child collection of record."""
+        if self._children is None and self._load_children is not None:
+            self._children = self._load_children()
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
+
+
+class Record(_HasChildren, list):
     """Index based collection record. with support for nested collections.
 
     Example:
@@ -25,17 +40,20 @@ class Record(list):
     >>> r = Record([1, 2, 3], children='testing')
     >>> r.children
     'testing'
+    >>> Record([1, 2, 3], load_children=lambda: 'loaded').children
+    'loaded'
     """
     
-    def __init__(self, iterable, children=None):
-        super(Record, self).__init__(iterable)
-        self.children = children
+    def __init__(self, iterable, children=None, load_children=None):
+        list.__init__(self, iterable)
+        self._children = children
+        self._load_children = load_children
 
     def __hash__(self):
         return hash(''.join(str(x) for x in self))
 
 
-class NamedRecord(dict):
+class NamedRecord(_HasChildren, dict):
     """Key based collection record, with support for nested collections.
 
     Example:
@@ -46,9 +64,10 @@ class NamedRecord(dict):
     'testing'
     """
 
-    def __init__(self, mapping, children=None):
-        super(NamedRecord, self).__init__(mapping)
-        self.children = children
+    def __init__(self, mapping, children=None, load_children=None):
+        dict.__init__(self, mapping)
+        self._children = children
+        self._load_children = load_children
 
     def __hash__(self):
         return hash(''.join(x + str(self[x]) for x in sorted(self)))
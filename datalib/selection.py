@@ -0,0 +1,103 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Selection vectors.
+
+Filtering a collection keeps the positions of the surviving rows instead of
+copying them.  Filtering again narrows the positions, and the rows are only
+copied out when a selection keeps few of its rows or when code needs the
+underlying storage itself.
+"""
+
+from array import array
+from collections import MutableSequence
+from itertools import imap
+
+from datalib.columns import ColumnStore
+from datalib.spill import SpillStore
+
+
+class Selection(MutableSequence):
+    """Rows of data at given positions.
+
+    Selecting from a selection narrows its positions, reading the same data.
+
+    >>> rows = Selection([['a'], ['b'], ['c'], ['d']], [0, 2, 3])
+    >>> list(Selection(rows, [1, 2]))
+    [['c'], ['d']]
+    >>> Selection(rows, [1, 2]).positions
+    array('l', [2, 3])
+    """
+
+    def __init__(self, data, positions):
+        if isinstance(data, Selection):
+            positions = [data.positions[idx] for idx in positions]
+            data = data.data
+        self.data = data
+        self.positions = array('l', positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return imap(self.data.__getitem__, self.positions)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.data[pos] for pos in self.positions[idx]]
+        return self.data[self.positions[idx]]
+
+    def __setitem__(self, idx, row):
+        self.data[self.positions[idx]] = row
+
+    def __delitem__(self, idx):
+        del self.positions[idx]
+
+    def __repr__(self):
+        return "<Selection %s of %s rows>" % (len(self), len(self.data))
+
+    def insert(self, idx, row):
+        self.data.append(row)
+        self.positions.insert(idx, len(self.data) - 1)
+
+    def extend(self, rows):
+        start = len(self.data)
+        self.data.extend(rows)
+        self.positions.extend(xrange(start, len(self.data)))
+
+    def compact(self):
+        """Return copy of the selected rows, in the storage of data."""
+        if isinstance(self.data, (ColumnStore, SpillStore)):
+            return self.data.take(self.positions)
+        return [self.data[pos] for pos in self.positions]
+
+
+def select(data, positions):
+    """Return rows of data at given positions.
+
+    The result is a selection of data, unless it would keep under a quarter
+    of the rows data holds, in which case they are copied out (so the rows
+    dropped by repeated filtering are eventually released).
+
+    >>> select(range(8), [1])
+    [1]
+    >>> select(range(8), [1, 2, 3, 4, 5])
+    <Selection 5 of 8 rows>
+    """
+    selection = Selection(data, positions)
+    if len(selection) * 4 < len(selection.data):
+        return selection.compact()
+    return selection
@@ -0,0 +1,176 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Streaming collection serializers.
+
+Rows are read straight from collection storage (list rows or typed column
+arrays), a chunk at a time, and each chunk is formatted into a buffer that is
+written out in one call.
+"""
+
+import bz2
+import csv
+import gzip
+import json
+from contextlib import contextmanager
+from cStringIO import StringIO
+from datetime import date
+from itertools import izip
+
+from datalib.columns import ColumnStore
+
+
+CHUNK_SIZE = 4096
+
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2'}
+
+
+class _Compressor(object):
+    """Write-only file object compressing into another file object."""
+
+    def __init__(self, stream, compressor):
+        self.stream = stream
+        self.compressor = compressor
+
+    def write(self, data):
+        self.stream.write(self.compressor.compress(data))
+
+    def close(self):
+        self.stream.write(self.compressor.flush())
+
+
+@contextmanager
+def _open(target, compression):
+    """Open target (a path or a file object) for writing.
+
+    compression may be 'gzip', 'bz2' or None; for paths it defaults to the
+    compression matching the file suffix.
+    """
+    if isinstance(target, basestring):
+        if compression is None:
+            for suffix, name in COMPRESSION_SUFFIXES.iteritems():
+                if target.endswith(suffix):
+                    compression = name
+        if compression == 'gzip':
+            stream = gzip.open(target, 'wb')
+        elif compression == 'bz2':
+            stream = bz2.BZ2File(target, 'wb')
+        elif compression is None:
+            stream = open(target, 'wb')
+        else:
+            raise ValueError("unknown compression: %r" % compression)
+    elif compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=target, mode='wb')
+    elif compression == 'bz2':
+        stream = _Compressor(target, bz2.BZ2Compressor())
+    elif compression is None:
+        yield target
+        return
+    else:
+        raise ValueError("unknown compression: %r" % compression)
+
+    try:
+        yield stream
+    finally:
+        stream.close()
+
+
+def _select(collection, columns):
+    """Return positions and names (None if unnamed) of selected columns."""
+    names = getattr(collection, 'names', None)
+    if columns is None:
+        return range(collection.width), names
+    positions = [collection._column_index(column) for column in columns]
+    if names is not None:
+        names = [names[idx] for idx in positions]
+    return positions, names
+
+
+def _chunks(collection, positions, size):
+    """Yield lists of row tuples holding the columns at given positions."""
+    collection._compact()
+    data = collection.data
+    if isinstance(data, ColumnStore):
+        columns = [data.columns[idx] for idx in positions]
+        for start in xrange(0, len(data), size):
+            yield zip(*[column[start:start + size] if isinstance(column, list)
+                else column.slice(start, start + size) for column in columns])
+    else:
+        for start in xrange(0, len(data), size):
+            yield [tuple([row[idx] for idx in positions])
+                    for row in data[start:start + size]]
+
+
+def _json_default(value):
+    """Serialize values json does not handle natively."""
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def write_csv(collection, target, columns=None, header=True,
+        compression=None, chunk_size=CHUNK_SIZE, **fmtparams):
+    """Write collection rows to target as CSV.
+
+    A header row is written for named collections (unless header is False).
+    Only the given columns are written, if any are given; extra keyword
+    arguments are csv format parameters.
+
+    >>> from datalib.hcollections import NamedCollection
+    >>> out = StringIO()
+    >>> write_csv(NamedCollection(('a', 'b'), [(1, 'x'), (2, 'y')]), out,
+    ...     columns=['b'], lineterminator='\\n')
+    >>> out.getvalue()
+    'b\\nx\\ny\\n'
+    """
+    positions, names = _select(collection, columns)
+    buf = StringIO()
+    writer = csv.writer(buf, **fmtparams)
+
+    with _open(target, compression) as stream:
+        if header and names is not None:
+            writer.writerow(names)
+        for chunk in _chunks(collection, positions, chunk_size):
+            writer.writerows(chunk)
+            stream.write(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+        stream.write(buf.getvalue())
+
+
+def write_jsonl(collection, target, columns=None, compression=None,
+        chunk_size=CHUNK_SIZE):
+    """Write collection rows to target as JSON Lines.
+
+    Rows of named collections are written as objects, other rows as arrays.
+
+    >>> from datalib.hcollections import Collection
+    >>> out = StringIO()
+    >>> write_jsonl(Collection([(1, 'x'), (2, None)]), out)
+    >>> out.getvalue()
+    '[1, "x"]\\n[2, null]\\n'
+    """
+    positions, names = _select(collection, columns)
+    encode = json.JSONEncoder(default=_json_default).encode
+
+    with _open(target, compression) as stream:
+        for chunk in _chunks(collection, positions, chunk_size):
+            if names is None:
+                lines = [encode(row) for row in chunk]
+            else:
+                lines = [encode(dict(izip(names, row))) for row in chunk]
+            lines.append('')
+            stream.write('\n'.join(lines))
@@ -0,0 +1,285 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Approximate aggregates and row sampling.
+
+The sketches here read a column in one pass with fixed memory, and can be
+merged like the exact aggregates (so they also run partition by partition).
+Their size is set by the error bound they are created with.
+"""
+
+from array import array
+from math import ceil, e, log
+from random import Random, getrandbits
+
+from datalib.aggregates import Aggregate
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _hash64(value):
+    """Return well mixed 64-bit hash of value.
+
+    hash() of small integers is the integer itself, so it is mixed with the
+    MurmurHash3 finalizer.
+    """
+    h = hash(value) & _MASK64
+    h = ((h ^ (h >> 33)) * 0xff51afd7ed558ccd) & _MASK64
+    h = ((h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53) & _MASK64
+    return h ^ (h >> 33)
+
+
+class DistinctCount(Aggregate):
+    """Approximate number of distinct values (HyperLogLog).
+
+    error is the relative standard error of the estimate; the sketch uses
+    about (1.04 / error) ** 2 one-byte registers.
+
+    >>> agg = DistinctCount(error=0.02)
+    >>> abs(agg.final(agg.fold(range(10000))) - 10000) < 600
+    True
+    """
+
+    def __init__(self, error=0.01):
+        self.precision = min(18, max(4, int(ceil(log((1.04 / error) ** 2, 2)))))
+
+    def initial(self):
+        return bytearray(1 << self.precision)
+
+    def step(self, state, value):
+        return self.fold((value,), state)
+
+    def fold(self, values, state=None):
+        if state is None:
+            state = self.initial()
+        precision = self.precision
+        bits = 64 - precision
+        low = (1 << bits) - 1
+        for value in values:
+            h = _hash64(value)
+            rank = bits - (h & low).bit_length() + 1
+            if rank > state[h >> bits]:
+                state[h >> bits] = rank
+        return state
+
+    def merge(self, state, other):
+        return bytearray(max(a, b) for a, b in zip(state, other))
+
+    def final(self, state):
+        m = len(state)
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in state)
+        zeros = state.count('\x00')
+        if estimate <= 2.5 * m and zeros:
+            # small range correction (linear counting)
+            estimate = m * log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class Quantile(Aggregate):
+    """Approximate quantiles (KLL sketch).
+
+    q is a quantile (0 to 1) or a sequence of them.  error is the rank error
+    of the result; the sketch keeps about 3 / error values.
+
+    >>> agg = Quantile(0.5, error=0.02)
+    >>> abs(agg.final(agg.fold(range(10000))) - 5000) < 400
+    True
+    """
+
+    def __init__(self, q=0.5, error=0.01):
+        self.q = q
+        self.k = max(8, int(ceil(1.7 / error)))
+
+    def initial(self):
+        return [[]]
+
+    def step(self, state, value):
+        state[0].append(value)
+        if len(state[0]) >= self._capacity(0, len(state)):
+            self._compress(state)
+        return state
+
+    def merge(self, state, other):
+        state = [list(level) for level in state]
+        for h, level in enumerate(other):
+            if h == len(state):
+                state.append([])
+            state[h].extend(level)
+        self._compress(state)
+        return state
+
+    def final(self, state):
+        items = sorted((value, 1 << h)
+                for h, level in enumerate(state) for value in level)
+        if not items:
+            return None
+        if isinstance(self.q, (list, tuple)):
+            return [self._quantile(items, q) for q in self.q]
+        return self._quantile(items, self.q)
+
+    def _capacity(self, h, height):
+        """Capacity of level h of a sketch with height levels."""
+        return max(2, int(ceil(self.k * (2.0 / 3) ** (height - 1 - h))))
+
+    def _compress(self, state):
+        """Compact levels that are over capacity."""
+        h = 0
+        while h < len(state):
+            if len(state[h]) >= self._capacity(h, len(state)):
+                if h + 1 == len(state):
+                    state.append([])
+                level = sorted(state[h])
+                state[h] = [level.pop()] if len(level) % 2 else []
+                state[h + 1].extend(level[getrandbits(1)::2])
+            h += 1
+
+    def _quantile(self, items, q):
+        """Return q-quantile of sorted (value, weight) items."""
+        target = q * sum(weight for value, weight in items)
+        seen = 0
+        for value, weight in items:
+            seen += weight
+            if seen >= target:
+                return value
+        return items[-1][0]
+
+
+class HeavyHitters(Aggregate):
+    """Most frequent values with approximate counts (count-min sketch).
+
+    Counts are over-estimated by at most error times the number of values,
+    with probability confidence.  The final value is a list of the k most
+    frequent (value, count) pairs.
+
+    >>> agg = HeavyHitters(k=2)
+    >>> agg.final(agg.fold('abracadabra'))
+    [('a', 5), ('b', 2)]
+    """
+
+    def __init__(self, k=10, error=0.001, confidence=0.99):
+        self.k = k
+        self.width = int(ceil(e / error))
+        self.depth = int(ceil(log(1 / (1 - confidence))))
+
+    def initial(self):
+        return ([array('l', [0]) * self.width for idx in xrange(self.depth)],
+                {})
+
+    def step(self, state, value):
+        return self.fold((value,), state)
+
+    def fold(self, values, state=None):
+        if state is None:
+            state = self.initial()
+        table, top = state
+        width, k = self.width, self.k
+        for value in values:
+            h = _hash64(value)
+            h1, h2 = h & 0xffffffff, h >> 32
+            count = None
+            for idx, row in enumerate(table):
+                pos = (h1 + idx * h2) % width
+                row[pos] += 1
+                if count is None or row[pos] < count:
+                    count = row[pos]
+            if value in top or len(top) < k:
+                top[value] = count
+            else:
+                smallest = min(top, key=top.get)
+                if count > top[smallest]:
+                    del top[smallest]
+                    top[value] = count
+        return state
+
+    def merge(self, state, other):
+        table = [array('l', (a + b for a, b in zip(row, other_row)))
+                for row, other_row in zip(state[0], other[0])]
+        counts = dict((value, self._estimate(table, value))
+                for value in set(state[1]) | set(other[1]))
+        top = dict(sorted(counts.iteritems(), key=lambda x: -x[1])[:self.k])
+        return (table, top)
+
+    def final(self, state):
+        return sorted(state[1].iteritems(), key=lambda x: (-x[1], x[0]))
+
+    def _estimate(self, table, value):
+        """Return estimated count of value."""
+        h = _hash64(value)
+        h1, h2 = h & 0xffffffff, h >> 32
+        return min(row[(h1 + idx * h2) % self.width]
+                for idx, row in enumerate(table))
+
+
+class Sample(object):
+    """Uniform random sample of rows, kept as rows are added.
+
+    An integer size keeps that many rows (reservoir sampling); a float size
+    keeps each row with that probability.
+    """
+
+    def __init__(self, size, seed=None):
+        if isinstance(size, float) and not 0 <= size <= 1:
+            raise ValueError("sample fraction out of range: %r" % size)
+        self.size = size
+        self.seen = 0
+        self.kept = 0
+        self.random = Random(seed)
+
+    def copy(self):
+        """Return sample in the same state, deciding independently of this
+        one from now on."""
+        sample = Sample(self.size)
+        sample.seen, sample.kept = self.seen, self.kept
+        sample.random.setstate(self.random.getstate())
+        return sample
+
+    def offer(self, count):
+        """Decide which of count new rows join the sample.
+
+        Returns, per row, None to drop it, or the slot of the sample it
+        takes: a new slot while the sample is filling up, or the slot of the
+        row it replaces.  Samples of a fraction of rows have no slots, they
+        only add rows (-1).
+        """
+        decisions = []
+        for idx in xrange(count):
+            self.seen += 1
+            if isinstance(self.size, float):
+                decisions.append(-1 if self.random.random() < self.size
+                        else None)
+            elif self.kept < self.size:
+                self.kept += 1
+                decisions.append(self.kept - 1)
+            else:
+                slot = self.random.randrange(self.seen)
+                decisions.append(slot if slot < self.size else None)
+        return decisions
+
+    def slots(self, count):
+        """Return positions of the rows sampled out of count rows, in order
+        of the slots they take (in order of position for a fraction)."""
+        positions = []
+        for idx, decision in enumerate(self.offer(count)):
+            if decision == -1 or decision == len(positions):
+                positions.append(idx)
+            elif decision is not None:
+                positions[decision] = idx
+        return positions
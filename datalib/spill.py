@@ -0,0 +1,231 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#                    Kenny Parnell <k.parnell@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Spilling rows to disk.
+
+A collection created with spill=True keeps its rows in a SpillStore: rows are
+held in chunks, and the least recently used chunks are written to a
+temporary directory when the chunks in memory go over the memory budget.
+Iterating a store reads one chunk at a time, so code streaming over the rows
+of a collection (filters, new columns, grouping) runs unchanged.
+"""
+
+from bisect import bisect_right
+from collections import MutableSequence, OrderedDict
+from cPickle import HIGHEST_PROTOCOL, dumps, loads
+from hashlib import sha1
+from itertools import count, islice
+from os import path, remove
+from shutil import rmtree
+from sys import getsizeof
+from tempfile import mkdtemp
+
+
+# rows per chunk
+CHUNK_SIZE = 4096
+
+
+def _chunk_size(rows):
+    """Return estimated bytes held by a chunk of rows (measured on its first
+    row, not counting classes such as PlaceHolderColumn)."""
+    if not rows:
+        return 0
+    row = rows[0]
+    return len(rows) * (getsizeof(row) + sum(getsizeof(value)
+        for value in row if not isinstance(value, type)))
+
+
+class SpillPool(object):
+    """Chunks of spill stores, kept in memory up to memory_budget bytes.
+
+    Chunks read back from disk are only written again if they changed.
+    """
+
+    def __init__(self, memory_budget, directory=None):
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self._tempdir = None
+        self._hot = OrderedDict()
+        self._used = 0
+        self._keys = count()
+
+    def __del__(self):
+        if self._tempdir is not None:
+            rmtree(self._tempdir, ignore_errors=True)
+
+    def __repr__(self):
+        return "<SpillPool %s chunks in memory, %s bytes>" % (len(self._hot),
+                self._used)
+
+    def new_key(self):
+        """Return key for a new chunk."""
+        return next(self._keys)
+
+    def load(self, key):
+        """Return rows of chunk, reading it from disk if it was spilled."""
+        if key in self._hot:
+            entry = self._hot.pop(key)
+            self._hot[key] = entry
+            return entry[0]
+        with open(self._path(key), 'rb') as f:
+            data = f.read()
+        rows = loads(data)
+        self._add(key, rows, sha1(data).digest())
+        return rows
+
+    def store(self, key, rows):
+        """Add new chunk of rows."""
+        self._add(key, rows, None)
+
+    def discard(self, key):
+        """Forget chunk."""
+        if key in self._hot:
+            self._used -= self._hot.pop(key)[2]
+        elif path.exists(self._path(key)):
+            remove(self._path(key))
+
+    def _add(self, key, rows, digest):
+        """Hold chunk in memory, spilling others if over budget."""
+        size = _chunk_size(rows)
+        self._hot[key] = (rows, digest, size)
+        self._used += size
+        while self._used > self.memory_budget and len(self._hot) > 1:
+            self._spill(*self._hot.popitem(last=False))
+
+    def _spill(self, key, entry):
+        """Write chunk to disk (unless unchanged since it was read)."""
+        rows, digest, size = entry
+        self._used -= size
+        data = dumps(rows, HIGHEST_PROTOCOL)
+        if sha1(data).digest() != digest:
+            with open(self._path(key), 'wb') as f:
+                f.write(data)
+
+    def _path(self, key):
+        """Return path of file holding chunk."""
+        if self._tempdir is None:
+            self._tempdir = mkdtemp(prefix='datalib-', dir=self.directory)
+        return path.join(self._tempdir, str(key))
+
+
+class SpillStore(MutableSequence):
+    """Sequence of rows held in chunks of a SpillPool.
+
+    >>> store = SpillStore(SpillPool(1000), ([x] for x in range(100)),
+    ...     chunk_size=10)
+    >>> store[42]
+    [42]
+    >>> store
+    <SpillStore 100 rows, 10 chunks>
+    >>> sum(row[0] for row in store)
+    4950
+    """
+
+    def __init__(self, pool, rows=(), chunk_size=CHUNK_SIZE):
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self._chunks = []
+        self._lengths = []
+        self._starts = []
+        self.extend(rows)
+
+    def __del__(self):
+        for key in self._chunks:
+            self.pool.discard(key)
+
+    def __len__(self):
+        if not self._chunks:
+            return 0
+        return self._starts[-1] + self._lengths[-1]
+
+    def __iter__(self):
+        for key in self._chunks:
+            for row in self.pool.load(key):
+                yield row
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[pos] for pos in xrange(*idx.indices(len(self)))]
+        chunk, pos = self._locate(idx)
+        return self.pool.load(self._chunks[chunk])[pos]
+
+    def __setitem__(self, idx, row):
+        chunk, pos = self._locate(idx)
+        self.pool.load(self._chunks[chunk])[pos] = row
+
+    def __delitem__(self, idx):
+        chunk, pos = self._locate(idx)
+        del self.pool.load(self._chunks[chunk])[pos]
+        self._lengths[chunk] -= 1
+        self._reindex()
+
+    def __repr__(self):
+        return "<SpillStore %s rows, %s chunks>" % (len(self),
+                len(self._chunks))
+
+    def insert(self, idx, row):
+        if idx >= len(self):
+            self.extend((row,))
+            return
+        chunk, pos = self._locate(idx)
+        self.pool.load(self._chunks[chunk]).insert(pos, row)
+        self._lengths[chunk] += 1
+        self._reindex()
+
+    def extend(self, rows):
+        rows = iter(rows)
+        if self._chunks and self._lengths[-1] < self.chunk_size:
+            last = self.pool.load(self._chunks[-1])
+            last.extend(islice(rows, self.chunk_size - len(last)))
+            self._lengths[-1] = len(last)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            key = self.pool.new_key()
+            self._chunks.append(key)
+            self._lengths.append(len(chunk))
+            self._starts.append(0)
+            self.pool.store(key, chunk)
+        self._reindex()
+
+    def hot_rows(self):
+        """Return rows of the chunks held in memory."""
+        hot = self.pool._hot
+        return [row for key in self._chunks if key in hot
+                for row in hot[key][0]]
+
+    def take(self, indices):
+        """Return new store (in the same pool) of copies of the rows at
+        given positions."""
+        return SpillStore(self.pool, (list(self[idx]) for idx in indices),
+                self.chunk_size)
+
+    def _locate(self, idx):
+        """Return chunk number and position in chunk of row idx."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('list index out of range')
+        chunk = bisect_right(self._starts, idx) - 1
+        return chunk, idx - self._starts[chunk]
+
+    def _reindex(self):
+        """Recompute the start position of each chunk."""
+        start = 0
+        for chunk, length in enumerate(self._lengths):
+            self._starts[chunk] = start
+            start += length
@@ -16,8 +16,15 @@
 
 """Collection change transaction."""
 
-from collections import defaultdict, Mapping
-from itertools import ifilter, chain, groupby
+from collections import defaultdict, MutableSequence, OrderedDict
+from itertools import chain, compress, imap, izip
+from operator import itemgetter
+
+from datalib.cache import Unfingerprintable, fingerprint
+from datalib.columns import ColumnStore, TypedColumn
+from datalib.selection import Selection, select
+from datalib.sketches import Sample
+from datalib.spill import SpillStore
 
 
 class ValueNotProcessedError(Exception):
@@ -46,6 +53,198 @@ class TransactionAlreadyActiveError(Exception):
     pass
 
 
+def _collapse_key(record):
+    """Group key placing every row of a collection in a single group."""
+    return None
+
+
+def _column_values(rows, column):
+    """Return non-null values of column in rows, read straight from the
+    column array when rows are stored by column type."""
+    if isinstance(rows, ColumnStore):
+        values = rows.columns[column]
+        if isinstance(values, TypedColumn):
+            return values.valid_values()
+        if None not in values:
+            return values
+        return [value for value in values if value is not None]
+    return (value for value in imap(itemgetter(column), rows)
+            if value is not None)
+
+
+def _column_order(instructions, columns):
+    """Return new column instructions (computing given columns) ordered so
+    that columns are computed after the new columns they reference.
+
+    Instructions list the columns they read in a references attribute.
+    Raises DependencyResolutionError if columns reference each other.
+    """
+    pending = [(column, instruction, set(getattr(instruction, 'references',
+        ())) & set(columns)) for column, instruction in zip(columns,
+            instructions)]
+    done, order = set(), []
+    while pending:
+        for entry in pending:
+            column, instruction, references = entry
+            if references <= done:
+                done.add(column)
+                order.append(instruction)
+                pending.remove(entry)
+                break
+        else:
+            raise DependencyResolutionError([('new_cols',
+                'circular reference in columns %s'
+                % ', '.join(str(entry[0]) for entry in pending))])
+    return order
+
+
+def _take(data, positions):
+    """Return rows of data at given positions."""
+    if isinstance(data, (ColumnStore, SpillStore)):
+        return data.take(positions)
+    return [data[idx] for idx in positions]
+
+
+def _leaf_rows(collection):
+    """Return rows of collection, or the rows of all its groups if it is
+    grouped."""
+    children = collection._child_collections
+    if not children:
+        return collection.data
+    return list(chain.from_iterable(
+        children.rows(idx) for idx in sorted(children)))
+
+
+class _PendingGroup(object):
+    """Rows of a group whose child collection has not been built yet.
+
+    The child is built from the rows on first access and grouped on the
+    remaining group levels, with the aggregates of its parent.  Children
+    built from rows shared with a copy of the parent copy them when first
+    changed.
+    """
+
+    def __init__(self, parent, rows, levels, shared=False):
+        self.parent = parent
+        self.rows = rows
+        self.levels = levels
+        self.shared = shared
+
+    def build(self):
+        parent = self.parent
+        child = parent._factory_rows(self.rows)
+        child._shared = self.shared
+        if self.levels:
+            child.transaction.begin()
+            for level in self.levels:
+                child.transaction.add('group', level)
+            for instructions in parent.transaction.pipeline:
+                for instruction in instructions['aggregate']:
+                    child.transaction.add('aggregate', instruction)
+            child.transaction.commit()
+        return child
+
+
+class _Children(dict):
+    """Child collections of a grouped collection, keyed by group position.
+
+    Children are built when first accessed.
+    """
+
+    def __getitem__(self, idx):
+        child = dict.__getitem__(self, idx)
+        if isinstance(child, _PendingGroup):
+            child = child.build()
+            dict.__setitem__(self, idx, child)
+        return child
+
+    def get(self, idx, default=None):
+        if idx in self:
+            return self[idx]
+        return default
+
+    def iteritems(self):
+        for idx in self:
+            yield idx, self[idx]
+
+    def itervalues(self):
+        for idx in self:
+            yield self[idx]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def built(self, idx):
+        """Return child at idx if it has been built, None otherwise."""
+        child = dict.__getitem__(self, idx)
+        if isinstance(child, _PendingGroup):
+            return None
+        return child
+
+    def rows(self, idx):
+        """Return rows of group at idx, without building its child."""
+        child = dict.__getitem__(self, idx)
+        if isinstance(child, _PendingGroup):
+            return child.rows
+        return _leaf_rows(child)
+
+    def copy(self, parent):
+        """Return copy of children for a copy of their parent."""
+        children = _Children()
+        for idx in self:
+            child = dict.__getitem__(self, idx)
+            if isinstance(child, _PendingGroup):
+                child = _PendingGroup(parent,
+                        _take(child.rows, xrange(len(child.rows))),
+                        child.levels)
+            else:
+                child = child.copy()
+            dict.__setitem__(children, idx, child)
+        return children
+
+    def share(self, parent):
+        """Return children for a copy of their parent (or a transaction
+        cache), sharing rows and built children until either is changed."""
+        children = _Children()
+        for idx in self:
+            child = dict.__getitem__(self, idx)
+            if isinstance(child, _PendingGroup):
+                child.shared = True
+                child = _PendingGroup(parent, child.rows, child.levels, True)
+            else:
+                child = child.copy()
+            dict.__setitem__(children, idx, child)
+        return children
+
+    def add_rows(self, idx, rows):
+        """Add rows to group at idx."""
+        child = dict.__getitem__(self, idx)
+        if isinstance(child, _PendingGroup):
+            child.rows.extend(rows)
+        else:
+            child.append(rows)
+
+
+class _AppendBatch(object):
+    """Rows being appended to a collection, as they pass its pipeline.
+
+    Until the pipeline groups them, rows are plain rows.  After that, rows
+    holds the records of new groups (with (key, pending group, aggregate
+    states) for each in groups) and touched maps positions of existing groups
+    to the rows they gained.  slots lists the (slot, row) of rows taken by
+    the sample of an ungrouped collection, in the order they were offered.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.groups = None
+        self.touched = {}
+        self.slots = []
+
+
 class Transaction(object):
     """Collection transaction."""
 
@@ -53,6 +252,10 @@ class Transaction(object):
         self.active = False
         self._collection = collection
         self._instructions = defaultdict(list)
+        self._committing = None
+        self._cache_key = None
+        self.cache = None
+        self.pipeline = []
 
 
     def __len__(self):
@@ -84,6 +287,14 @@ class Transaction(object):
         1
         """
         self._instructions[type].append(instruction)
+        if type == 'new_cols' and self._collection._width_known():
+            new_cols = self._instructions['new_cols']
+            width = self._collection.width
+            try:
+                _column_order(new_cols, range(width, width + len(new_cols)))
+            except DependencyResolutionError:
+                new_cols.pop()
+                raise
 
         # If session is not actively in use, apply atomically
         if not self.active:
@@ -113,13 +324,22 @@ class Transaction(object):
 
     def commit(self, start_at=0, last_errors=None):
         """Apply requested instructions to bound collection."""
+        if last_errors is None:
+            # Keep instructions as requested, commit methods consume them
+            self._committing = defaultdict(list, ((name, list(instructions))
+                for name, instructions in self._instructions.iteritems()))
+            if self._commit_cached():
+                return
+            self._collection._unshare()
+
         # Make sure our dataset is mutable
-        self._collection.data = list(self._collection.data)
+        if not isinstance(self._collection.data, MutableSequence):
+            self._collection.data = list(self._collection.data)
         self._allocate_new_cols()
         errors, first_err_at = [], 99
         
         for idx, (name, commit_method) in enumerate(self.commit_methods):
-            if name not in self._instructions:
+            if not self._instructions.get(name):
                 continue
             try:
                 commit_method(self, self._instructions[name])
@@ -131,82 +351,355 @@ class Transaction(object):
             if errors != last_errors:
                 self.commit(first_err_at, errors)
             else:
+                self._collection._changed()
                 self.rollback()
                 raise DependencyResolutionError(errors)
         else:
-            self.active = False
-            self.instructions = defaultdict(list)
+            self._collection.width += len(self._instructions['new_cols'])
+            self._collection._changed()
+            if self._cache_key is not None:
+                self.cache.put(self._cache_key, self._collection._snapshot())
+            self._finish()
+            self._collection._check_memory()
+
+
+    def _commit_cached(self):
+        """Restore result of transaction from cache, if it is there.
+
+        Returns True if the collection was restored."""
+        self._cache_key = None
+        if self.cache is None or not any(self._committing.itervalues()):
+            return False
+        try:
+            self._cache_key = (self._collection._state, fingerprint(
+                [(name, self._committing[name])
+                    for name, commit_method in self.commit_methods]))
+        except Unfingerprintable:
+            return False
+
+        snapshot = self.cache.get(self._cache_key)
+        if snapshot is None:
+            return False
+        for idx, instruction in enumerate(self._committing['new_cols']):
+            instruction.column_idx = self._collection.width + idx
+        self._collection._restore(snapshot)
+        self._finish()
+        return True
+
+
+    def _finish(self):
+        """Record committed instructions and deactivate transaction."""
+        if any(self._committing.itervalues()):
+            self.pipeline.append(self._committing)
+        self.active = False
+        self._instructions = defaultdict(list)
+
+
+    def append(self, rows):
+        """Run new rows through the committed pipeline of bound collection.
+
+        Only the given rows are processed: rows joining existing groups are
+        added to their child collection and the group's aggregate state is
+        updated from the new rows alone.
+        """
+        if self.active:
+            raise TransactionAlreadyActiveError
+        self._collection._unshare()
+
+        batch = _AppendBatch([list(x) for x in rows])
+        if batch.rows and not self._collection._width_known():
+            self._set_width(len(batch.rows[0]))
+        for instructions in self.pipeline:
+            placeholders = ([PlaceHolderColumn] *
+                    len(instructions['new_cols']))
+            for row in batch.rows:
+                row.extend(placeholders)
+            for name, append_method in self.append_methods:
+                if instructions[name]:
+                    append_method(self, instructions[name], batch)
+
+        collection = self._collection
+        if batch.groups is None:
+            self._append_rows(batch)
+        else:
+            for record, (key, group, states) in zip(batch.rows, batch.groups):
+                idx = len(collection.data)
+                collection._group_index[key] = idx
+                collection._child_collections[idx] = group
+                collection._group_states[idx] = states
+                collection.data.append(record)
+        collection._changed()
+        collection._check_memory()
+
+
+    def copy_pipeline(self):
+        """Return committed pipeline for a copy of the bound collection.
+
+        Samples are copied, as they keep the state of the rows they were
+        offered; other instructions are shared.
+        """
+        return [defaultdict(list, ((name, [instruction.copy()
+            if isinstance(instruction, Sample) else instruction
+            for instruction in entries])
+            for name, entries in instructions.iteritems()))
+            for instructions in self.pipeline]
+
+
+    def _set_width(self, width):
+        """Take width of the first rows added to a collection, placing the
+        new columns of its pipeline after them."""
+        for instructions in self.pipeline:
+            for instruction in instructions['new_cols']:
+                instruction.column_idx = width
+                width += 1
+        self._collection.width = width
+
+
+    def _append_rows(self, batch):
+        """Add rows that passed the pipeline to an ungrouped collection.
+
+        A row taking the slot of a sampled row replaces it.  A sampled row
+        whose slot went to a row dropped later in the pipeline (or replaced
+        again in the same batch) is removed.
+        """
+        collection = self._collection
+        slots = collection._sample_slots
+        taken = dict(batch.slots)
+        offered = set(id(row) for slot, row in batch.slots)
+        kept = dict((id(row), slot) for slot, row in taken.iteritems())
+        passed = set(id(row) for row in batch.rows)
+
+        dropped = set(slots.pop(slot) for slot, row in taken.iteritems()
+                if id(row) not in passed and slot in slots)
+        rows = []
+        for row in batch.rows:
+            slot = kept.get(id(row))
+            if slot is None:
+                if id(row) not in offered:
+                    rows.append(row)
+            elif slot in slots:
+                collection.data[slots[slot]] = row
+            else:
+                slots[slot] = len(collection.data) + len(rows)
+                rows.append(row)
+        collection.data.extend(rows)
+        if dropped:
+            self._select([idx for idx in xrange(len(collection.data))
+                if idx not in dropped])
 
     
     def _allocate_new_cols(self):
         """Allocate PlaceHolderColumn instances for each new column."""
+        if not self._instructions['new_cols']:
+            return
         for idx, instruction in enumerate(self._instructions['new_cols']):
             instruction.column_idx = self._collection.width + idx
 
         placeholders = ([PlaceHolderColumn] * 
                 len(self._instructions['new_cols']))
-        for row in self._collection.data:
-            row.extend(placeholders)
+        self._collection._compact()
+        if isinstance(self._collection.data, ColumnStore):
+            self._collection.data.add_columns(placeholders)
+        else:
+            for row in self._collection.data:
+                row.extend(placeholders)
 
 
     def _commit_filter(self, instructions):
-        """Apply requested filters to collection."""
-        col = iter(self._collection)
-        for instruction in instructions:
-            col = ifilter(instruction, col)
+        """Narrow collection to rows matching filters.
 
-        col = list(col)
-        if not col:
-            self._collection.data = []
-        else:
-            if isinstance(col[0], Mapping):
-                self._collection.data = [
-                        [x[y] for y in self._collection.names] for x in col]
+        Each filter is only called for the rows kept by the ones before it,
+        and the result selects the kept rows rather than copying them.
+        """
+        collection = self._collection
+        data = collection.data
+        positions = None
+        if isinstance(data, Selection):
+            data, positions = data.data, data.positions
+        record, load = collection._record, collection._load_children
+        keep = xrange(len(collection.data))
+        for instruction in instructions:
+            # rows are read straight from the selected storage in one pass
+            rows = imap(data.__getitem__, keep if positions is None
+                    else imap(positions.__getitem__, keep))
+            if collection._child_collections:
+                keep = [idx for idx, row in izip(keep, rows)
+                        if instruction(record(row, load(idx)))]
             else:
-                self._collection.data = list(col)
+                keep = [idx for idx, row in izip(keep, rows)
+                        if instruction(record(row))]
+        self._select(keep)
 
 
-    def _commit_group(self, instructions):
-        """Apply requested  group operations to collection."""
-        groupinst = instructions[0]
+    def _commit_sample(self, instructions):
+        """Keep a random sample of collection rows.
+
+        The positions of the rows in the slots of the sample are kept (for an
+        ungrouped collection), so appended rows replace the rows they take
+        the slot of.
+        """
+        collection = self._collection
+        for instruction in instructions:
+            slots = instruction.slots(len(collection.data))
+            positions = sorted(slots)
+            self._select(positions)
+            collection._sample_slots = {}
+            if not isinstance(instruction.size, float) and \
+                    not collection._group_index:
+                moved = dict((old, new) for new, old in enumerate(positions))
+                collection._sample_slots = dict((slot, moved[idx])
+                        for slot, idx in enumerate(slots))
+
+
+    def _select(self, positions):
+        """Narrow collection to rows at given positions; sampled rows and the
+        groups of a grouped collection are moved to their new positions."""
+        collection = self._collection
+        collection.data = select(collection.data, positions)
+        if not collection._group_index and not collection._sample_slots:
+            return
+
+        moved = dict((old, new) for new, old in enumerate(positions))
+        collection._sample_slots = dict((slot, moved[idx])
+                for slot, idx in collection._sample_slots.iteritems()
+                if idx in moved)
+        if not collection._group_index:
+            return
+
+        children = collection._child_collections
+        collection._child_collections = children.__class__()
+        for old in children:
+            if old in moved:
+                # pending groups are moved without building them
+                dict.__setitem__(collection._child_collections, moved[old],
+                        dict.__getitem__(children, old))
+        collection._group_index = dict((key, moved[idx])
+                for key, idx in collection._group_index.iteritems()
+                if idx in moved)
+        collection._group_states = dict((moved[idx], states)
+                for idx, states in collection._group_states.iteritems()
+                if idx in moved)
+
+
+    def _group_key(self, groupinst):
+        """Return key function and key column position for a group
+        instruction (position is None for function based grouping)."""
+        if callable(groupinst):
+            return groupinst, None
+        return itemgetter(groupinst), self._collection._column_index(groupinst)
+
+
+    def _group_keys(self, groupinst, rows):
+        """Return group key of each of given rows."""
+        groupfn, key_idx = self._group_key(groupinst)
+        if key_idx is not None:
+            # column keys are read from stored rows, skipping records
+            if isinstance(rows, ColumnStore):
+                return list(rows.columns[key_idx])
+            return map(itemgetter(key_idx), rows)
+        return [groupfn(self._collection._record(row)) for row in rows]
+
+
+    def _group_record(self, key, key_idx, rows):
+        """Return new group record for group of given rows."""
+        group_record = [None] * len(rows[0])
+        if key_idx is not None:
+            group_record[key_idx] = key
+        return group_record
 
-        if not callable(groupinst):
-            groupfn = lambda x: x[groupinst]
-            if hasattr(self._collection, 'names'):
-                groupinst_key = self._collection.names.index(groupinst)
-            else:
-                groupinst_key = groupinst
-        else:
-            groupfn = groupinst
 
-        child_collections = defaultdict(None)
-        record_length = len(self._collection[0])
+    def _commit_group(self, instructions):
+        """Apply requested group operations to collection.
+
+        Rows are partitioned on the first group level in a single pass.  The
+        child collection of each group is built (and grouped on the remaining
+        levels) when it is first accessed.
+        """
+        collection = self._collection
+        collection._compact()
+        # resolve every level now, so bad columns fail in this commit
+        levels = [self._group_key(groupinst) for groupinst in instructions]
+        key_idx = levels[0][1]
+
+        groups = OrderedDict()
+        for idx, key in enumerate(self._group_keys(instructions[0],
+                collection.data)):
+            groups.setdefault(key, []).append(idx)
+
+        child_collections = _Children()
+        group_index = {}
         records = []
-        for key, sub in groupby(self._collection, groupfn):
-            sub = self._collection.factory(sub)
-            group_record = [None] * record_length
-            if not callable(groupinst):
-                group_record[groupinst_key] = sub[0][groupinst]
-            records.append(group_record)
-            child_collections[len(child_collections)] = sub
+        for key, positions in groups.iteritems():
+            rows = _take(collection.data, positions)
+            group_index[key] = len(records)
+            child_collections[len(records)] = _PendingGroup(collection, rows,
+                    instructions[1:])
+            records.append(self._group_record(key, key_idx, rows))
 
-        self._collection.data = records
-        self._collection._child_collections = child_collections
+        collection.data = records
+        collection._child_collections = child_collections
+        collection._group_index = group_index
+        collection._group_states = {}
+        collection._sample_slots = {}
 
-        instructions[:] = instructions[1:]
+        instructions[:] = []
 
 
     def _commit_new_cols(self, instructions):
-        """Add calculated and formatted columns to collection."""
-        for idx, row in enumerate(self._collection.data):
+        """Add calculated and formatted columns to collection, each computed
+        after the new columns it references."""
+        if not self._collection._width_known():
+            # no rows, and their columns are only known once rows are added
+            return
+        collection = self._collection
+        instructions = _column_order(instructions,
+                [instruction.column_idx for instruction in instructions])
+        data = collection.data
+        if isinstance(data, ColumnStore) and len(data):
+            # computed a column at a time, from tuples zipped out of the
+            # column arrays rather than through row views
             for instruction in instructions:
-                row[instruction.column_idx] = instruction(row, self._collection)
-            self._collection.data[idx] = row
+                data.columns[instruction.column_idx] = [
+                        instruction(row, collection)
+                        for row in izip(*data.columns)]
+            return
+        for row in data:
+            for instruction in instructions:
+                row[instruction.column_idx] = instruction(row, collection)
 
 
     def _commit_aggregate(self, instructions):
-        """Apply column aggregations."""
-        pass
+        """Apply column aggregations to every level of grouped collection."""
+        collection = self._collection
+        if not collection._child_collections:
+            self._commit_group([_collapse_key])
+
+        children = collection._child_collections
+        for idx in children:
+            states = collection._group_states.setdefault(idx, {})
+            for instruction in instructions:
+                states.pop(instruction, None)
+            self._aggregate(collection.data[idx], states, instructions,
+                    children.rows(idx))
+
+            # children not built yet pick up aggregates when they are built
+            child = children.built(idx)
+            if child is not None and child._child_collections:
+                child.transaction.begin()
+                for instruction in instructions:
+                    child.transaction.add('aggregate', instruction)
+                child.transaction.commit()
+
+
+    def _aggregate(self, group_record, states, instructions, rows):
+        """Fold rows into aggregate states of a group and store the results
+        in its group record."""
+        for instruction in instructions:
+            column, aggregate = instruction
+            state = aggregate.fold(_column_values(rows, column),
+                    states.get(instruction))
+            states[instruction] = state
+            group_record[column] = aggregate.final(state)
 
 
     def _commit_sort(self, instructions):
@@ -216,8 +709,92 @@ class Transaction(object):
 
     commit_methods = (
             ('filter', _commit_filter),
+            ('sample', _commit_sample),
             ('group', _commit_group),
             ('new_cols', _commit_new_cols),
             ('aggregate', _commit_aggregate),
             ('sort', _commit_sort),)
 
+
+    def _append_filter(self, instructions, batch):
+        """Drop new rows (or new groups) that do not match filters."""
+        for instruction in instructions:
+            keep = [bool(instruction(self._collection._record(row)))
+                    for row in batch.rows]
+            batch.rows = list(compress(batch.rows, keep))
+            if batch.groups is not None:
+                batch.groups = list(compress(batch.groups, keep))
+
+
+    def _append_sample(self, instructions, batch):
+        """Offer new rows to samples; a sampled row may replace one already
+        kept (only while the collection is not grouped)."""
+        for instruction in instructions:
+            decisions = instruction.offer(len(batch.rows))
+            batch.slots = []
+            if batch.groups is None and not isinstance(instruction.size,
+                    float):
+                batch.slots = [(slot, row) for row, slot
+                        in zip(batch.rows, decisions) if slot is not None]
+            keep = [decision is not None for decision in decisions]
+            batch.rows = list(compress(batch.rows, keep))
+            if batch.groups is not None:
+                batch.groups = list(compress(batch.groups, keep))
+
+
+    def _append_group(self, instructions, batch):
+        """Add new rows to existing groups, or group them into new ones."""
+        collection = self._collection
+        key_idx = self._group_key(instructions[0])[1]
+
+        new_groups = OrderedDict()
+        for row, key in zip(batch.rows,
+                self._group_keys(instructions[0], batch.rows)):
+            if key in collection._group_index:
+                batch.touched.setdefault(
+                        collection._group_index[key], []).append(row)
+            else:
+                new_groups.setdefault(key, []).append(row)
+
+        for idx, rows in batch.touched.iteritems():
+            collection._child_collections.add_rows(idx, rows)
+
+        batch.rows, batch.groups = [], []
+        for key, rows in new_groups.iteritems():
+            batch.rows.append(self._group_record(key, key_idx, rows))
+            batch.groups.append((key,
+                _PendingGroup(collection, rows, instructions[1:]), {}))
+
+
+    def _append_new_cols(self, instructions, batch):
+        """Calculate new columns for new rows and for changed groups."""
+        collection = self._collection
+        rows = batch.rows + [collection.data[idx] for idx in batch.touched]
+        instructions = _column_order(instructions,
+                [instruction.column_idx for instruction in instructions])
+        for row in rows:
+            for instruction in instructions:
+                row[instruction.column_idx] = instruction(row, collection)
+
+
+    def _append_aggregate(self, instructions, batch):
+        """Update aggregates of changed groups with their new rows."""
+        if batch.groups is None:
+            self._append_group([_collapse_key], batch)
+
+        collection = self._collection
+        for idx, rows in batch.touched.iteritems():
+            self._aggregate(collection.data[idx],
+                    collection._group_states.setdefault(idx, {}),
+                    instructions, rows)
+        for record, (key, group, states) in zip(batch.rows, batch.groups):
+            self._aggregate(record, states, instructions, group.rows)
+
+
+    append_methods = (
+            ('filter', _append_filter),
+            ('sample', _append_sample),
+            ('group', _append_group),
+            ('new_cols', _append_new_cols),
+            ('aggregate', _append_aggregate),)
+
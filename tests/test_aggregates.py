@@ -0,0 +1,66 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test aggregates."""
+
+from datalib.aggregates import (Count, Max, Mean, Min, Reduce, 
+        Sum, aggregator)
+
+
+VALUES = (4, 1, 3, 2)
+
+
+def _apply(aggregate, values):
+    return aggregate.final(aggregate.fold(values))
+
+
+def test_builtin():
+    assert _apply(Count(), VALUES) == 4
+    assert _apply(Sum(), VALUES) == 10
+    assert _apply(Min(), VALUES) == 1
+    assert _apply(Max(), VALUES) == 4
+    assert _apply(Mean(), VALUES) == 2.5
+
+
+def test_incremental():
+    for aggregate in (Count(), Sum(), Min(), Max(), Mean()):
+        state = aggregate.fold(VALUES[:2])
+        state = aggregate.fold(VALUES[2:], state)
+        assert aggregate.final(state) == _apply(aggregate, VALUES)
+
+
+def test_aggregator():
+    assert isinstance(aggregator(Sum), Sum)
+    mean = Mean()
+    assert aggregator(mean) is mean
+    assert isinstance(aggregator(len), Reduce)
+    assert _apply(aggregator(len), VALUES) == 4
+
+
+def test_merge():
+    for aggregate in (Count(), Sum(), Min(), Max(), Mean(), Reduce(sorted)):
+        state = aggregate.merge(aggregate.fold(VALUES[:1]), 
+                aggregate.fold(VALUES[1:]))
+        assert aggregate.final(state) == _apply(aggregate, VALUES)
+
+    assert Max().merge(3, None) == 3
+
+
+def test_equality():
+    assert Sum() == Sum()
+    assert Sum() != Count()
+    assert Reduce(sorted) == Reduce(sorted)
+    assert Reduce(sorted) != Reduce(len)
+    assert len(set([(0, Sum()), (0, Sum()), (1, Sum())])) == 2
@@ -0,0 +1,176 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test transaction cache."""
+
+import os
+from types import ModuleType
+
+from py.test import raises
+
+from datalib.aggregates import Sum
+from datalib.cache import (TransactionCache, Unfingerprintable, 
+        fingerprint)
+from datalib.hcollections import Collection, NamedCollection
+
+
+GROUP_DATA = ('a', 'b'), ((1, 2), (1, 3), (1, 4), (2, 1))
+
+
+def test_fingerprint():
+    def fmt_fn(fmt):
+        def _do_format(row, collection):
+            return fmt.format(*row)
+        return _do_format
+
+    assert fingerprint(fmt_fn('{0}')) == fingerprint(fmt_fn('{0}'))
+    assert fingerprint(fmt_fn('{0}')) != fingerprint(fmt_fn('{1}'))
+    assert fingerprint((0, Sum())) == fingerprint((0, Sum()))
+    assert fingerprint(['a', 1]) != fingerprint(('a', 1))
+    raises(Unfingerprintable, fingerprint, {})
+
+
+_threshold = 0
+_settings = ModuleType('_settings')
+
+
+def _above_threshold(row):
+    return row[0] > _threshold
+
+
+def test_fingerprint_globals():
+    global _threshold
+    base = Collection([(x,) for x in range(10)], cache=TransactionCache())
+    lengths = []
+    for _threshold in (2, 7):
+        col = base.copy()
+        col.filter(lambda r: _above_threshold(r))
+        lengths.append(len(col))
+    assert lengths == [7, 2]
+
+    # attributes read from modules are fingerprinted by value
+    lengths = []
+    for _settings.THRESHOLD in (5, 8):
+        col = base.copy()
+        col.filter(lambda r: r[0] > _settings.THRESHOLD)
+        lengths.append(len(col))
+    assert lengths == [4, 1]
+    fingerprint(lambda r: os.path.join(*r))
+
+    # functions calling themselves can be fingerprinted
+    def _recursive(n):
+        return n and _recursive(n - 1)
+    fingerprint(_recursive)
+
+
+def test_lru():
+    cache = TransactionCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert (cache.hits, cache.misses, len(cache)) == (3, 1, 2)
+
+
+def test_cached_transaction():
+    cache = TransactionCache()
+    col = NamedCollection(*GROUP_DATA, cache=cache)
+
+    results = []
+    for idx in range(3):
+        view = col.copy()
+        with view:
+            view.filter(lambda r: r['b'] > 1)
+            view.add_calculated_column('c', '{b} * 2')
+        with view:
+            view.group(['a'])
+            view.aggregate({'b': Sum, 'c': Sum})
+        results.append([dict(x) for x in view])
+    assert results[0] == results[1] == results[2] == [
+            {'a': 1, 'b': 9, 'c': 18}]
+    assert [x['c'] for x in view[0].children] == [4, 6, 8]
+    assert (cache.hits, cache.misses) == (4, 2)
+    assert len(col) == 4
+    assert col.names == ['a', 'b']
+
+    # changing a cached view leaves the cached result alone
+    view.append([(1, 5), (2, 1)])
+    assert [dict(x) for x in view] == [{'a': 1, 'b': 14, 'c': 28}]
+
+    view = col.copy()
+    with view:
+        view.filter(lambda r: r['b'] > 1)
+        view.add_calculated_column('c', '{b} * 2')
+    with view:
+        view.group(['a'])
+        view.aggregate({'b': Sum, 'c': Sum})
+    assert [dict(x) for x in view] == [{'a': 1, 'b': 9, 'c': 18}]
+    assert len(view[0].children) == 3
+    assert cache.hits == 6
+
+    # a hit takes the cached rows without copying the source first
+    first, second = col.copy(), col.copy()
+    first.filter(lambda r: r['b'] > 1)
+    second.filter(lambda r: r['b'] > 1)
+    assert second.data is first.data
+    assert len(col) == 4
+
+    # different instructions are not mixed up
+    view = col.copy()
+    view.add_formatted_column('c', '{a}-{b}')
+    other = col.copy()
+    other.add_formatted_column('c', '{b}-{a}')
+    assert (view[0]['c'], other[0]['c']) == ('1-2', '2-1')
+
+
+def test_invalidate():
+    cache = TransactionCache()
+    col = Collection(GROUP_DATA[1], cache=cache)
+
+    view = col.copy()
+    view.filter(lambda r: r[0] == 1)
+    assert len(view) == 3
+
+    col.append([(1, 5)])
+    view = col.copy()
+    view.filter(lambda r: r[0] == 1)
+    assert len(view) == 4
+    assert cache.hits == 0
+
+    view = col.copy()
+    view.filter(lambda r: r[0] == 2)
+    assert len(view) == 1
+    assert cache.hits == 0
+
+
+def test_shared_children():
+    for cache in (None, TransactionCache()):
+        col = Collection(GROUP_DATA[1], group=[0], cache=cache)
+        view = col.copy()
+        view[0].children.filter(lambda r: r[1] > 2)
+        assert len(view[0].children) == 2
+        assert len(col[0].children) == 3
+
+        # children of a cached result are not changed through a hit
+        first, second = col.copy(), col.copy()
+        first.filter(lambda r: r[0] == 1)
+        second.filter(lambda r: r[0] == 1)
+        first[0].children.append([(1, 5)])
+        assert len(second[0].children) == 3
+        assert len(col.copy()[0].children) == 3
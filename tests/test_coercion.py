@@ -0,0 +1,102 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test column coercion."""
+
+from datetime import date
+from decimal import Decimal
+
+from py.test import raises
+
+from datalib import coercion
+from datalib.coercion import CoercionError, coerce_column, coerce_rows
+from datalib.hcollections import Collection, NamedCollection
+
+
+def _rows():
+    return [['1', '2010-06-01', '1.10'], ['x', '2010-6-2', None],
+            ['3', 'y', 'z']]
+
+
+def test_coerce_column():
+    assert coerce_column(['1', '2'], int) == ([1, 2], [])
+    assert coerce_column([' 2010-06-01', date(2010, 1, 1)],
+            coercion.converter(date))[0] == [date(2010, 6, 1),
+                    date(2010, 1, 1)]
+    assert coerce_column(['1.5', None], Decimal)[0] == [Decimal('1.5'), None]
+    assert coerce_column([None, 0], bool)[0] == [None, False]
+
+    # cells that are not strings fail like other bad values
+    converted, failures = coerce_column(['2010-06-01', 20100601],
+            coercion.converter(date), 'null')
+    assert converted == [date(2010, 6, 1), None]
+    assert [row for row, column, value, message in failures] == [1]
+
+
+def test_policies():
+    coercions = {0: int, 1: date, 2: Decimal}
+
+    rows = _rows()
+    ex = raises(CoercionError, coerce_rows, rows, coercions).value
+    assert ex.errors == [(1, 0, 'x', "invalid literal for int() with base "
+        "10: 'x'")]
+    assert rows == _rows()
+
+    rows = _rows()
+    coerce_rows(rows, coercions, 'null')
+    assert rows == [[1, date(2010, 6, 1), Decimal('1.10')],
+            [None, date(2010, 6, 2), None], [3, None, None]]
+
+    rows = _rows()
+    ex = raises(CoercionError, coerce_rows, rows, coercions, 'collect').value
+    assert [(row, column) for row, column, value, message in ex.errors] == \
+            [(1, 0), (2, 1), (2, 2)]
+
+    raises(ValueError, coerce_rows, rows, coercions, 'ignore')
+
+
+def test_parallel(monkeypatch):
+    monkeypatch.setattr(coercion, 'CHUNK_SIZE', 10)
+    rows = [[str(x), 'x' if x == 42 else '%s.5' % x] for x in range(100)]
+    ex = raises(CoercionError, coerce_rows, rows, {0: int, 1: float},
+            'collect', processes=2).value
+    assert [error[:3] for error in ex.errors] == [(42, 1, 'x')]
+    assert rows[99] == [99, 99.5]
+    assert rows[42] == [42, None]
+
+
+def test_collection_coerce():
+    col = Collection([('1', 'a'), ('x', 'b')], coerce={0: int},
+            coerce_errors='null')
+    assert [list(row) for row in col] == [[1, 'a'], [None, 'b']]
+
+    col.append([('y', 'c')])
+    assert list(col[2]) == [None, 'c']
+
+    raises(CoercionError, NamedCollection, ['a'], [('x',)],
+            coerce={'a': int})
+
+    # collect keeps the rows and lists their failing cells
+    col = NamedCollection(['a', 'b'], [('1', 'a'), ('x', 'b')],
+            coerce={'a': int}, coerce_errors='collect')
+    assert [dict(row) for row in col] == [{'a': 1, 'b': 'a'},
+            {'a': None, 'b': 'b'}]
+    assert [error[:3] for error in col.coercion_errors] == [(1, 0, 'x')]
+
+    col.append([('y', 'c'), ('3', 'd')])
+    assert len(col) == 4
+    assert [error[:3] for error in col.coercion_errors] == [(0, 0, 'y')]
+    col.append([('4', 'e')])
+    assert col.coercion_errors == []
@@ -16,9 +16,15 @@
 
 """Test Collection."""
 
+from array import array
+
 from py.test import raises
 
+from datalib.aggregates import Count, Mean, Sum
+from datalib.columns import ColumnStore, TypedColumn
 from datalib.hcollections import Collection
+from datalib.selection import Selection
+from datalib.transaction import TransactionAlreadyActiveError
 
 
 BASIC_DATA = ((1,2,3),(4,5,6))
@@ -137,3 +143,263 @@ def test_group():
         for row in col:
             assert len(row) == 2
 
+
+
+def test_consecutive_columns():
+    col = Collection(BASIC_DATA)
+    col.add_calculated_column('{0} + {1}')
+    col.add_calculated_column('{3} * 2')
+    assert list(col[0]) == [1, 2, 3, 3, 6]
+
+
+def test_aggregate():
+    col = Collection(GROUP_DATA, group=[0], aggregate={1: Count})
+    assert [list(x) for x in col] == [['a', 3], ['b', 1]]
+
+    # ungrouped collections aggregate into a single row
+    col = Collection(BASIC_DATA, aggregate={0: Sum, 2: max})
+    assert len(col) == 1
+    assert col[0][0] == 5
+    assert col[0][2] == 6
+    assert len(col[0].children) == 2
+
+
+def test_append():
+    col = Collection(BASIC_DATA, coerce={0: float},
+            filter=(lambda x: x[0] < 5,), calculated_columns=('{0} + {1}',))
+    col.append([('7', 8, 9), ('2', 2, 2)])
+    assert len(col) == 3
+    assert list(col[2]) == [2.0, 2, 2, 4.0]
+
+
+def test_append_group():
+    col = Collection(GROUP_DATA, group=[0], aggregate={1: Count})
+    children = col[0].children
+
+    col.append([('b', 'e'), ('c', 'f'), ('a', 'g')])
+    assert [list(x) for x in col] == [['a', 4], ['b', 2], ['c', 1]]
+    assert col[0].children is children
+    assert list(children[3]) == ['a', 'g']
+    assert list(col[2].children[0]) == ['c', 'f']
+
+    # groups are created on append if the collection started empty
+    col = Collection([], group=[0], aggregate={1: Sum})
+    col.append([('a', 1), ('b', 2)])
+    col.append([('a', 3)])
+    assert [list(x) for x in col] == [['a', 4], ['b', 2]]
+
+
+def test_filter_group():
+    col = Collection([('a', 1), ('b', 2)], group=[0], aggregate={1: Sum})
+    col.filter(lambda r: r[1] > 1)
+    assert [list(x) for x in col] == [['b', 2]]
+    assert [list(x) for x in col[0].children] == [['b', 2]]
+
+    # groups dropped by the filter are not folded into the ones kept
+    col.append([('a', 5), ('b', 3)])
+    assert [list(x) for x in col] == [['b', 5], ['a', 5]]
+    assert [list(x) for x in col[0].children] == [['b', 2], ['b', 3]]
+
+
+def test_filter_selection():
+    data = [(x, x % 3) for x in range(12)]
+    col = Collection(data, filter=(lambda x: x[1] != 0,))
+    rows = col.data.data
+    assert isinstance(col.data, Selection)
+
+    # chained filters narrow the same selection
+    with col:
+        col.filter(lambda x: x[0] > 2)
+    assert col.data.data is rows
+    assert [x[0] for x in col] == [4, 5, 7, 8, 10, 11]
+
+    # rows are copied out once few of them are selected
+    with col:
+        col.filter(lambda x: x[0] > 9)
+    assert col.data == [[10, 1], [11, 2]]
+
+    col.append([(13, 1)])
+    assert len(col) == 3
+
+
+def test_sample():
+    col = Collection([(x,) for x in range(100)])
+    with col:
+        col.sample(10, seed=0)
+    assert len(col) == 10
+
+    col.append([(x,) for x in range(100, 1100)])
+    assert len(col) == 10
+    assert any(row[0] >= 100 for row in col)
+
+    # appended rows take the slots of sampled rows, filtered or not
+    col = Collection([(x,) for x in range(100)])
+    col.sample(20, seed=0)
+    col.filter(lambda r: r[0] < 40)
+    assert len(col) == 11
+    col.append([(x,) for x in range(100, 200)])
+    assert len(col) < 11
+    assert all(row[0] < 40 for row in col)
+    col.append([(x % 40,) for x in range(1000)])
+    assert 0 < len(col) <= 20
+    assert sorted(col._sample_slots.values()) == range(len(col))
+
+    # copies sample appended rows independently
+    col = Collection([(x,) for x in range(100)])
+    col.sample(10, seed=0)
+    first, second = col.copy(), col.copy()
+    first.append([(x,) for x in range(100, 200)])
+    second.append([(x,) for x in range(100, 200)])
+    assert list(first) == list(second)
+    assert col.transaction.pipeline[0]['sample'][0].seen == 100
+
+    col = Collection([(x % 2, x) for x in range(100)])
+    with col:
+        col.sample(0.5, seed=0)
+        col.group([0])
+        col.aggregate({1: Count})
+    assert sum(row[1] for row in col) == len(set(
+        child[1] for row in col for child in row.children))
+
+
+def test_append_during_transaction():
+    col = Collection(BASIC_DATA)
+    with col:
+        raises(TransactionAlreadyActiveError, col.append, [(1, 2, 3)])
+
+
+def test_encode():
+    data = [(x, y) for x, y in GROUP_DATA]
+    data.insert(0, (''.join(['a']), 'e'))
+    col = Collection(data, encode=[0], group=[0])
+
+    assert col.dictionary(0).values == ['a', 'b']
+    assert len(col) == 2
+    assert len(set(id(x[0]) for x in col[0].children)) == 1
+
+    col.append([('c', 'f'), ('b', 'g')])
+    assert col.dictionary(0).values == ['a', 'b', 'c']
+    assert col[1].children[1][0] is col.dictionary(0).decode(1)
+
+
+def test_schema():
+    data = [('a', '1', '2.5'), ('b', '2', None), ('a', '3', '1.5')]
+    col = Collection(data, schema={1: 'int64', 2: 'float64'},
+            filter=(lambda x: x[1] > 1,), calculated_columns=('{1} * 2',))
+
+    # filtering selects rows of the store without copying them
+    assert isinstance(col.data, Selection)
+    assert isinstance(col.data.data, ColumnStore)
+    assert isinstance(col.column(1), TypedColumn)
+    assert [list(x) for x in col] == [['b', 2, None, 4], ['a', 3, 1.5, 6]]
+
+    col.append([('c', '4', '0.5')])
+    assert list(col.column(2)) == [None, 1.5, 0.5]
+    assert col.column(2).null_count == 1
+
+    # commits without new columns leave column-wise selections in place
+    col = Collection(data, schema={1: 'int64'})
+    col.filter(lambda x: x[1] > 1)
+    store = col.data.data
+    col.filter(lambda x: x[1] < 4)
+    assert col.data.data is store
+    assert [x[1] for x in col] == [2, 3]
+
+    # new columns are computed column-wise, after the columns they read
+    col = Collection([(1, 2.5), (2, None)], schema={0: 'int64', 1: 'float64'})
+    with col:
+        col.add_calculated_column('{3} + 1')
+        col.add_calculated_column('{0} * 2')
+    assert [list(x) for x in col] == [[1, 2.5, 3, 2], [2, None, 5, 4]]
+
+    # a rejected append leaves every column as it was
+    col = Collection([('a', 1), ('b', 2)], schema={1: 'int64'})
+    raises(ValueError, col.append, [('c', 'x')])
+    assert [len(column) for column in col.data.columns] == [2, 2]
+    col.append([('d', 4)])
+    assert [list(x) for x in col] == [['a', 1], ['b', 2], ['d', 4]]
+
+
+def test_from_rows():
+    rows = [[1, 2], [3, 4]]
+    col = Collection.from_rows(rows, calculated_columns=('{0} + {1}',))
+    assert col.data is rows
+    assert rows[1] == [3, 4, 7]
+
+    col = Collection.from_rows(((1, 2), (3, 4)))
+    assert col.data == [[1, 2], [3, 4]]
+
+
+def test_from_columns():
+    ids = array('l', [1, 2, 3])
+    col = Collection.from_columns([ids, ['a', 'b', 'a']], group=[1],
+            aggregate={0: Sum})
+    assert [list(x) for x in col] == [[4, 'a'], [2, 'b']]
+    assert col[0].children.column(0).values.tolist() == [1, 3]
+
+    col = Collection.from_buffer(bytearray(ids.tostring()), ['int64'])
+    assert [list(x) for x in col] == [[1], [2], [3]]
+    assert isinstance(col.column(0), TypedColumn)
+    col.append([(4,)])
+    assert col.column(0).values.tolist() == [1, 2, 3, 4]
+
+    raises(ValueError, Collection.from_columns, [ids], spill=True,
+            memory_budget=1000)
+
+
+def test_schema_group():
+    data = [('a', 1, 2.0), ('a', 3, None), ('b', 5, 6.0)]
+    col = Collection(data, schema={1: 'int64', 2: 'float64'}, group=[0],
+            aggregate={1: Sum, 2: Mean})
+
+    assert isinstance(col[0].children.data, ColumnStore)
+    assert [list(x) for x in col] == [['a', 4, 2.0], ['b', 5, 6.0]]
+
+    col.append([('a', 2, 4.0)])
+    assert [list(x) for x in col] == [['a', 6, 3.0], ['b', 5, 6.0]]
+
+
+def test_aggregate_nulls():
+    data = [('a', 1), ('a', None), ('b', None)]
+    for schema in ({}, {1: 'int64'}):
+        col = Collection(data, schema=schema, group=[0],
+                aggregate={1: Count})
+        assert [list(x) for x in col] == [['a', 1], ['b', 0]]
+
+        col = Collection(data, schema=schema, group=[0],
+                aggregate={1: Sum})
+        col.append([('a', None), ('b', 2)])
+        assert [list(x) for x in col] == [['a', 1], ['b', 2]]
+
+        col = Collection(data, schema=schema, group=[0],
+                aggregate={1: Mean})
+        assert [list(x) for x in col] == [['a', 1.0], ['b', None]]
+
+
+def test_group_levels():
+    data = [('a', 'x', 1), ('b', 'x', 2), ('a', 'y', 3), ('a', 'x', 4)]
+    col = Collection(data, group=[0, 1], aggregate={2: Sum})
+
+    assert [list(x) for x in col] == [['a', None, 8], ['b', None, 2]]
+    assert col._child_collections.built(0) is None
+
+    sub = col[0].children
+    assert [list(x) for x in sub] == [[None, 'x', 5], [None, 'y', 3]]
+    assert [list(x) for x in sub[0].children] == [['a', 'x', 1], ['a', 'x', 4]]
+    assert col._child_collections.built(1) is None
+
+    col.append([('a', 'y', 10), ('b', 'z', 1)])
+    assert [list(x) for x in col] == [['a', None, 18], ['b', None, 3]]
+    assert [list(x) for x in sub] == [[None, 'x', 5], [None, 'y', 13]]
+    assert [list(x) for x in col[1].children] == [
+            [None, 'x', 2], [None, 'z', 1]]
+
+
+def test_group_levels_aggregate_later():
+    data = [('a', 'x', 1), ('a', 'y', 3), ('a', 'x', 4)]
+    col = Collection(data, group=[0, 1])
+    sub = col[0].children
+
+    col.aggregate({2: Count})
+    assert list(col[0]) == ['a', None, 3]
+    assert [list(x) for x in sub] == [[None, 'x', 2], [None, 'y', 1]]
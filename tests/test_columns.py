@@ -0,0 +1,116 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test typed column storage."""
+
+from array import array
+from datetime import date
+
+from py.test import raises
+
+from datalib.columns import (BOOL, DATE, FLOAT64, INT64, ColumnStore, 
+        TypedColumn, column_type)
+
+
+def test_typed_column():
+    column = TypedColumn(FLOAT64, ['1.5', 2, None])
+    assert list(column) == [1.5, 2.0, None]
+    assert column.values.typecode == 'd'
+    assert column.null_count == 1
+
+    column[2] = 3
+    column[0] = None
+    assert list(column) == [None, 2.0, 3.0]
+    assert column.null_count == 1
+    assert list(column.valid_values()) == [2.0, 3.0]
+
+    raises(ValueError, column.append, 'abc')
+    raises(ValueError, column.extend, [4, 'abc'])
+    assert (len(column), len(column.validity)) == (3, 1)
+
+
+def test_column_types():
+    assert column_type('int64') is INT64
+    assert list(TypedColumn(BOOL, ['true', 'no', 1])) == [True, False, True]
+    assert list(TypedColumn(DATE, ['2010-06-01', date(2010, 6, 2)])) == [
+            date(2010, 6, 1), date(2010, 6, 2)]
+
+
+def test_take():
+    column = TypedColumn(INT64, range(20))
+    assert list(column.take([1, 17])) == [1, 17]
+
+    column[3] = None
+    assert list(column.take([3, 4])) == [None, 4]
+
+
+def test_slice():
+    column = TypedColumn(INT64, range(5))
+    assert list(column.slice(3, 10)) == [3, 4]
+
+    column[3] = None
+    assert column.slice(2, 4) == [2, None]
+    assert TypedColumn(BOOL, [1, 0]).slice(0, 2) == [True, False]
+
+
+def test_column_store():
+    store = ColumnStore({1: INT64}, [('a', '1'), ('b', '2')])
+    assert len(store) == 2
+    assert list(store[0]) == ['a', 1]
+
+    store[1][1] = 5
+    store.append(('c', 6))
+    assert [list(x) for x in store] == [['a', 1], ['b', 5], ['c', 6]]
+
+    store.add_columns([None])
+    assert list(store[2]) == ['c', 6, None]
+
+    del store[0]
+    store.insert(0, ('d', 7, None))
+    assert [list(x) for x in store] == [['d', 7, None], ['b', 5, None], 
+            ['c', 6, None]]
+    assert isinstance(store.columns[1], TypedColumn)
+    raises(IndexError, store.__getitem__, 3)
+
+
+def test_store_from_columns():
+    ids = array('l', [1, 2])
+    store = ColumnStore.from_columns([ids, ('a', 'b'), TypedColumn(DATE)])
+    assert store.columns[0].values is ids
+    assert store.columns[1] == ['a', 'b']
+    assert store.schema == {0: INT64, 2: DATE}
+
+
+def test_store_from_buffer():
+    buffer = bytearray(array('l', [1, 2]).tostring() +
+            array('d', [0.5, 1.5]).tostring())
+    store = ColumnStore.from_buffer(buffer, ['int64', FLOAT64])
+    assert list(store[1]) == [2, 1.5]
+
+    # writable buffers are read in place
+    store[0][0] = 7
+    assert array('l', str(buffer[:8]))[0] == 7
+
+    store = ColumnStore.from_buffer(str(buffer), ['int64', 'float64'])
+    assert list(store.columns[0]) == [7, 2]
+
+    # columns are copied out of the buffer when extended
+    store = ColumnStore.from_buffer(buffer, ['int64', 'float64'])
+    store.append((3, None))
+    assert [list(x) for x in store] == [[7, 0.5], [2, 1.5], [3, None]]
+    assert isinstance(store.columns[0].values, array)
+    store[0][0] = 8
+    assert array('l', str(buffer[:8]))[0] == 7
@@ -0,0 +1,35 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test Dictionary encoding."""
+
+from datalib.encoding import Dictionary
+
+
+def test_encode():
+    d = Dictionary(['b', 'a'])
+    value = ''.join(['a'])
+
+    assert len(d) == 2
+    assert d.encode(value) is d.values[1]
+    assert d.code('a') == 1
+    assert d.decode(0) == 'b'
+    assert 'a' in d
+    assert 'c' not in d
+
+    d.encode('c')
+    assert d.code('c') == 2
+    assert len(d) == 3
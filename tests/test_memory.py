@@ -0,0 +1,81 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test memory accounting."""
+
+from datalib.aggregates import Sum
+from datalib.hcollections import Collection, NamedCollection
+from datalib.memory import estimate_usage
+from datalib.selection import Selection
+
+
+DATA = [('name%s' % (x % 10), x) for x in range(1000)]
+
+
+def test_memory_usage():
+    col = Collection(DATA)
+    usage = col.memory_usage()
+    assert usage.keys() == ['columns', 'rows', 'placeholders', 'selection',
+            'index', 'children', 'total']
+    assert usage['columns'].keys() == [0, 1]
+    assert usage['total'] > col.memory_usage(deep=False)['total']
+
+    # shared values are counted once
+    encoded = Collection(DATA, encode=[0]).memory_usage()
+    assert encoded['columns'][0] < usage['columns'][0]
+
+
+def test_memory_usage_parts():
+    col = NamedCollection(['name', 'value'], DATA, group=['name'],
+            aggregate={'value': Sum})
+    usage = col.memory_usage()
+    assert usage['columns'].keys() == ['name', 'value']
+    assert usage['index'] > 0
+    assert usage['children'] > usage['columns']['name']
+
+    col = Collection(DATA, schema={1: 'int64'})
+    usage = col.memory_usage()
+    assert usage['columns'][1] < Collection(DATA).memory_usage()['columns'][1]
+
+    with col:
+        col.filter(lambda x: x[1] % 2)
+    assert col.memory_usage()['selection'] > 0
+
+
+def test_memory_budget():
+    keep = lambda x: x[1] % 3
+    col = Collection(DATA, filter=(keep,))
+    assert isinstance(col.data, Selection)
+
+    col = Collection(DATA, filter=(keep,), memory_budget=1000)
+    assert not isinstance(col.data, Selection)
+    assert len(col) == 666
+
+
+def test_memory_budget_selected_rows():
+    # only selected rows are padded for new columns
+    col = Collection([(x, x) for x in range(12)],
+            filter=(lambda r: r[0] != 0,), memory_budget=10**9)
+    col.add_calculated_column('{0} + 1')
+    assert not col.transaction.active
+    assert col[0] == [1, 1, 2]
+    assert col.memory_usage()['columns'].keys() == [0, 1, 2]
+
+
+def test_estimate_usage():
+    for col in (Collection(DATA), Collection(DATA, schema={1: 'int64'}),
+            Collection(DATA, filter=(lambda x: x[1] % 3,))):
+        total = col.memory_usage()['total']
+        assert abs(estimate_usage(col, 100) - total) < total * 0.1
@@ -16,7 +16,11 @@
 
 """Test NamedCollection."""
 
+from py.test import raises
+
+from datalib.aggregates import Sum
 from datalib.hcollections import NamedCollection
+from datalib.transaction import DependencyResolutionError
 
 
 BASIC_DATA = ('a', 'b', 'c'), [[1,2,3],[4,5,6]]
@@ -72,6 +76,15 @@ def test_calculated_columns():
     assert col[1]['d'] == 9
 
 
+def test_rejected_column():
+    col = NamedCollection(['a'], [(1,)])
+    raises(DependencyResolutionError, col.add_formatted_column, 'b', '{b}')
+    assert col.names == ['a']
+
+    col.add_formatted_column('c', '{a}!')
+    assert col[0] == {'a': 1, 'c': '1!'}
+
+
 def test_filter():
     col = NamedCollection(*BASIC_DATA)
     col.filter(lambda x: x['a'] < 2)
@@ -97,3 +110,51 @@ def test_group():
         for row in col:
             assert len(row) == 2
 
+
+
+def test_aggregate():
+    col = NamedCollection(*GROUP_DATA, group=['a'], aggregate={'b': Sum})
+    assert col[0] == {'a': 1, 'b': 9}
+    assert col[1] == {'a': 2, 'b': 1}
+
+
+def test_append():
+    col = NamedCollection(*GROUP_DATA, coerce={'b': float}, group=['a'],
+            aggregate={'b': Sum})
+    col.append([(2, '4'), (3, '5')])
+    assert [dict(x) for x in col] == [
+            {'a': 1, 'b': 9.0}, {'a': 2, 'b': 5.0}, {'a': 3, 'b': 5.0}]
+    assert col[1].children[1] == {'a': 2, 'b': 4.0}
+
+
+def test_encode():
+    names, data = STRING_DATA
+    col = NamedCollection(names, data + (('foo', 'x', 'y'),), encode=['a'])
+    assert col.dictionary('a').values == ['foo', 'zip']
+    assert col[0]['a'] is col[2]['a']
+
+
+def test_schema():
+    col = NamedCollection(('a', 'b'), [('1', 'x'), ('2', 'y')],
+            schema={'a': 'int64'}, filter=(lambda x: x['a'] > 1,))
+    assert col.column('a').values.tolist() == [2]
+    assert col[0] == {'a': 2, 'b': 'y'}
+
+
+def test_from_rows():
+    rows = [[1, 'x'], [2, 'y']]
+    col = NamedCollection.from_rows(('a', 'b'), rows, group=['b'])
+    assert col[0]['a'] is None
+    assert col[1].children.data == [[2, 'y']]
+
+    col = NamedCollection.from_columns(('a', 'b'), [[1, 2], ['x', 'y']])
+    assert col[1] == {'a': 2, 'b': 'y'}
+
+
+def test_group_levels():
+    col = NamedCollection(('a', 'b', 'c'), [(1, 1, 1), (1, 2, 2), (1, 1, 3)],
+            group=['a', 'b'], aggregate={'c': Sum})
+    assert len(col) == 1
+    assert col[0]['c'] == 6
+    assert [x['c'] for x in col[0].children] == [4, 2]
+    assert len(col[0].children[0].children) == 2
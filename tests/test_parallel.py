@@ -0,0 +1,90 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test partitioned collections."""
+
+from ctypes import Array
+
+from py.test import raises
+
+from datalib.aggregates import Count, Max, Mean, Sum
+from datalib.hcollections import Collection, NamedCollection
+from datalib.parallel import PartitionedCollection
+
+
+NAMES = ('region', 'product', 'units', 'price')
+DATA = [('east', 'x', 1, 2.0), ('west', 'y', 2, 1.0), ('east', 'y', 3, 1.5),
+        ('north', 'x', 4, 3.0), ('west', 'x', 5, 2.5), ('east', 'x', 6, 1.0)]
+SCHEMA = {'units': 'int64', 'price': 'float64'}
+
+
+def test_partition():
+    col = NamedCollection(NAMES, DATA, schema=SCHEMA)
+    parts = PartitionedCollection(col, 'region', partitions=3)
+
+    assert len(parts) == len(DATA)
+    for idx in xrange(parts.partitions):
+        part = parts.partition(idx)
+        assert type(part) == type(col)
+        assert isinstance(part.column('units').values, Array)
+
+    regions = [set(row['region'] for row in parts.partition(idx)) 
+            for idx in xrange(parts.partitions)]
+    for idx, region_set in enumerate(regions):
+        for other in regions[idx + 1:]:
+            assert not region_set & other
+
+
+def test_range_partition():
+    col = Collection(DATA)
+    parts = PartitionedCollection(col, 2, partitions=3, by='range')
+    assert parts.bounds == [3, 5]
+    assert [len(parts.partition(idx)) for idx in xrange(3)] == [2, 2, 2]
+
+    parts = PartitionedCollection(col, 2, by='range', bounds=[2])
+    assert parts.partitions == 2
+    assert [list(x[2] for x in parts.partition(idx)) for idx in xrange(2)] \
+            == [[1], [2, 3, 4, 5, 6]]
+
+    raises(ValueError, PartitionedCollection, col, 2, by='spread')
+
+
+def test_map_reduce():
+    col = NamedCollection(NAMES, DATA, schema=SCHEMA)
+    parts = PartitionedCollection(col, 'product', partitions=2)
+
+    result = parts.map_reduce(filter=[lambda r: r['units'] > 1], 
+            calculated_columns=[('total', '{units} * {price}')],
+            group=['region'], 
+            aggregate={'units': Sum, 'total': Max, 'price': Mean}, 
+            processes=2)
+    assert type(result) == NamedCollection
+    assert sorted((x['region'], x['units'], x['total'], x['price']) 
+            for x in result) == [('east', 9, 6.0, 1.25), 
+                    ('north', 4, 12.0, 3.0), ('west', 7, 12.5, 1.75)]
+
+    result = parts.map_reduce(aggregate={'units': Count}, processes=2)
+    assert len(result) == 1
+    assert result[0]['units'] == 6
+
+
+def test_map_only():
+    col = Collection(DATA)
+    parts = PartitionedCollection(col, 0, partitions=2)
+    result = parts.map_reduce(filter=[lambda r: r[0] == 'west'], 
+            calculated_columns=['{2} + 1'])
+    assert sorted(list(x) for x in result) == [
+            ['west', 'x', 5, 2.5, 6], ['west', 'y', 2, 1.0, 3]]
@@ -0,0 +1,46 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test selection vectors."""
+
+from datalib.columns import ColumnStore
+from datalib.selection import Selection, select
+
+
+def test_selection():
+    data = [['a'], ['b'], ['c'], ['d']]
+    rows = Selection(data, [0, 2, 3])
+    assert len(rows) == 3
+    assert rows[1] == ['c']
+    assert rows[1:] == [['c'], ['d']]
+
+    rows.append(['e'])
+    assert list(rows) == [['a'], ['c'], ['d'], ['e']]
+    del rows[0]
+    rows.insert(0, ['f'])
+    assert list(rows) == [['f'], ['c'], ['d'], ['e']]
+    assert rows.compact() == [['f'], ['c'], ['d'], ['e']]
+
+
+def test_column_store():
+    store = ColumnStore({0: 'int64'}, [(x, str(x)) for x in range(8)])
+    rows = select(store, [1, 3, 5, 7])
+    assert rows.data is store
+    assert rows[1] == [3, '3']
+
+    compact = rows.compact()
+    assert isinstance(compact, ColumnStore)
+    assert list(compact.columns[0]) == [1, 3, 5, 7]
+    assert isinstance(select(rows, [0]), ColumnStore)
@@ -0,0 +1,88 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test collection serializers."""
+
+import bz2
+import gzip
+import json
+from cStringIO import StringIO
+
+from py.test import raises
+
+from datalib.hcollections import Collection, NamedCollection
+from datalib.serializers import write_csv, write_jsonl
+
+
+NAMES = ('a', 'b', 'c')
+DATA = [(1, 'foo', '2010-06-01'), (2, 'bar', None), (3, 'baz', '2010-06-03')]
+
+
+def test_csv():
+    col = NamedCollection(NAMES, DATA)
+    out = StringIO()
+    col.to_csv(out, lineterminator='\n', chunk_size=2)
+    assert out.getvalue().splitlines() == ['a,b,c', '1,foo,2010-06-01', 
+            '2,bar,', '3,baz,2010-06-03']
+
+    out = StringIO()
+    write_csv(Collection(DATA), out, columns=[1], lineterminator='\n')
+    assert out.getvalue() == 'foo\nbar\nbaz\n'
+
+    out = StringIO()
+    col.to_csv(out, header=False, columns=['b', 'a'], lineterminator='\n')
+    assert out.getvalue() == 'foo,1\nbar,2\nbaz,3\n'
+
+
+def test_csv_typed():
+    col = NamedCollection(NAMES, DATA, schema={'a': 'float64', 'c': 'date'})
+    out = StringIO()
+    col.to_csv(out, lineterminator='\n', chunk_size=2)
+    assert out.getvalue().splitlines()[1:] == ['1.0,foo,2010-06-01', 
+            '2.0,bar,', '3.0,baz,2010-06-03']
+
+
+def test_jsonl():
+    col = NamedCollection(NAMES, DATA, schema={'c': 'date'})
+    out = StringIO()
+    col.to_jsonl(out, columns=['a', 'c'], chunk_size=2)
+    lines = out.getvalue().splitlines()
+    assert [json.loads(x) for x in lines] == [
+            {'a': 1, 'c': '2010-06-01'}, {'a': 2, 'c': None}, 
+            {'a': 3, 'c': '2010-06-03'}]
+
+    out = StringIO()
+    write_jsonl(Collection(DATA), out, columns=[0, 1])
+    assert out.getvalue() == '[1, "foo"]\n[2, "bar"]\n[3, "baz"]\n'
+
+
+def test_compression(tmpdir):
+    col = NamedCollection(NAMES, DATA)
+
+    path = str(tmpdir.join('out.csv.gz'))
+    col.to_csv(path, lineterminator='\n')
+    assert gzip.open(path).read().startswith('a,b,c\n1,foo,')
+
+    out = StringIO()
+    col.to_jsonl(out, compression='bz2')
+    assert len(bz2.decompress(out.getvalue()).splitlines()) == 3
+
+    out = StringIO()
+    col.to_jsonl(out, compression='gzip')
+    data = gzip.GzipFile(fileobj=StringIO(out.getvalue())).read()
+    assert len(data.splitlines()) == 3
+
+    raises(ValueError, col.to_csv, StringIO(), compression='zip')
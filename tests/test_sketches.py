@@ -0,0 +1,96 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test approximate aggregates and sampling."""
+
+from random import Random
+
+from py.test import raises
+
+from datalib.sketches import DistinctCount, HeavyHitters, Quantile, Sample
+
+
+VALUES = range(20000)
+
+
+def _apply(aggregate, values):
+    return aggregate.final(aggregate.fold(values))
+
+
+def test_distinct_count():
+    values = [x % 5000 for x in VALUES]
+    assert abs(_apply(DistinctCount(), values) - 5000) < 250
+    assert _apply(DistinctCount(), 'aaabbc') == 3
+    assert _apply(DistinctCount(), []) == 0
+
+    # state size follows the error bound
+    assert len(DistinctCount(error=0.05).initial()) < \
+            len(DistinctCount(error=0.01).initial())
+
+
+def test_quantile():
+    values = list(VALUES)
+    Random(0).shuffle(values)
+    median, p90 = _apply(Quantile([0.5, 0.9]), values)
+    assert abs(median - 10000) < 400
+    assert abs(p90 - 18000) < 400
+    assert _apply(Quantile(), []) is None
+
+    # memory stays bounded
+    state = Quantile().fold(values)
+    assert sum(len(level) for level in state) < 1000
+
+
+def test_heavy_hitters():
+    values = ['a'] * 500 + ['b'] * 300 + [str(x) for x in VALUES[:2000]]
+    Random(0).shuffle(values)
+    top = _apply(HeavyHitters(k=2), values)
+    assert [value for value, count in top] == ['a', 'b']
+    assert top[0][1] >= 500
+
+
+def test_merge():
+    values = [x % 3000 for x in VALUES] + [7] * 100 + [8] * 50
+    for aggregate in (DistinctCount(), Quantile(0.5), HeavyHitters(k=2)):
+        state = aggregate.merge(aggregate.fold(values[:7000]),
+                aggregate.fold(values[7000:]))
+        exact = aggregate.final(aggregate.fold(values))
+        if isinstance(aggregate, Quantile):
+            assert abs(aggregate.final(state) - exact) < 200
+        else:
+            assert aggregate.final(state) == exact
+
+
+def test_sample():
+    sample = Sample(10, seed=0)
+    positions = sample.slots(100)
+    assert len(positions) == 10
+    assert len(set(positions)) == 10
+    assert all(0 <= x < 100 for x in positions)
+
+    # later rows replace kept rows at a falling rate
+    decisions = sample.offer(1000)
+    assert all(x is None or 0 <= x < 10 for x in decisions)
+    assert 0 < sum(x is not None for x in decisions) < 100
+    assert Sample(3, seed=0).offer(2) == [0, 1]
+
+    copied = sample.copy()
+    assert copied.offer(100) == sample.offer(100)
+    assert (copied.seen, copied.kept) == (sample.seen, sample.kept)
+
+    positions = Sample(0.25, seed=0).slots(1000)
+    assert 200 < len(positions) < 300
+    assert positions == sorted(positions)
+    raises(ValueError, Sample, 1.5)
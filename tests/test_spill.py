@@ -0,0 +1,71 @@
+# Copyright (C) 2010 Adam Wagner <awagner83@gmail.com>, 
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published 
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test spilling rows to disk."""
+
+import os
+
+from py.test import raises
+
+from datalib.aggregates import Sum
+from datalib.hcollections import Collection
+from datalib.spill import SpillPool, SpillStore
+
+
+def test_spill_store():
+    pool = SpillPool(2000)
+    store = SpillStore(pool, ([x, str(x)] for x in range(100)), chunk_size=10)
+    assert len(store) == 100
+    assert len(store.hot_rows()) < 100
+    assert os.listdir(pool._tempdir)
+
+    # rows changed in memory survive spilling
+    store[5][1] = 'five'
+    assert [row[0] for row in store] == range(100)
+    assert store[5] == [5, 'five']
+
+    del store[0]
+    store.insert(10, [-1, '-1'])
+    store.append([100, '100'])
+    assert len(store) == 101
+    assert store[9] == [10, '10']
+    assert store[10] == [-1, '-1']
+    assert store[-1] == [100, '100']
+    assert store[1:3] == [[2, '2'], [3, '3']]
+    raises(IndexError, store.__getitem__, 101)
+
+    taken = store.take([0, 50])
+    assert list(taken) == [[1, '1'], [50, '50']]
+    assert taken[0] is not store[0]
+
+
+def test_spill_collection():
+    data = (('k%s' % (x % 3), x) for x in range(20000))
+    col = Collection(data, spill=True, memory_budget=100000,
+            filter=(lambda x: x[1] % 2,), calculated_columns=('{1} * 2',))
+    # over budget, filtered rows are copied out into a new store
+    assert isinstance(col.data, SpillStore)
+    assert len(col) == 10000
+    assert sum(row[2] for row in col) == sum(2 * x for x in range(1, 20000, 2))
+
+    with col:
+        col.group([0])
+        col.aggregate({1: Sum})
+    assert sorted(list(row) for row in col)[0] == ['k0', 33326667, None]
+    assert len(col[0].children) == 3334
+
+    raises(ValueError, Collection, [], spill=True)
+    raises(ValueError, Collection, [], spill=True, memory_budget=1,
+            schema={0: 'int64'})
@@ -77,6 +77,19 @@ def test_commit_group():
     assert set(col2) == set(col)
 
 
+def test_commit_group_levels():
+    col = Collection([(1,2),(2,3),(1,2),(1,4)])
+    transaction = Transaction(col)
+    transaction._commit_group([0, 1])
+    assert len(col) == 2
+    assert len(col[0].children) == 2
+    assert len(col[0].children[0].children) == 2
+
+    # all levels are checked on commit
+    transaction = Transaction(NamedCollection(['a', 'b'], [[1, 2]]))
+    raises(DependencyResolutionError, transaction.add, 'group', 'c')
+
+
 def test_commit_error():
     transaction = Transaction(Collection([[1]]))
 
@@ -105,6 +118,65 @@ def test_commit_new_cols():
     assert len(col[0]) == 2
 
 
+def test_new_cols_order():
+    col = Collection([[1, 2]])
+    with col:
+        col.add_calculated_column('{3} + {4}')
+        col.add_calculated_column('{4} * 2')
+        col.add_calculated_column('{0} * 10')
+        col.add_formatted_column('{2}!')
+    assert list(col[0]) == [1, 2, 30, 20, 10, '30!']
+
+    col.append([[3, 4]])
+    assert list(col[1]) == [3, 4, 90, 60, 30, '90!']
+
+    # columns are computed once, in a single pass
+    calls = []
+    def _record_call(row, collection):
+        calls.append(row[2])
+        return row[2] + 1
+    _record_call.references = set([2])
+    col = Collection([[1]])
+    with col:
+        col.transaction.add('new_cols', _record_call)
+        col.add_calculated_column('{0} + 1')
+    assert calls == [2]
+    assert list(col[0]) == [1, 3, 2]
+
+
+def test_new_cols_cycle():
+    col = Collection([[1]])
+    col.transaction.begin()
+    col.add_calculated_column('{2} + 1')
+    raises(DependencyResolutionError, col.add_calculated_column, '{1} + 1')
+    raises(DependencyResolutionError, col.add_formatted_column, '{2}')
+
+    # refused columns are not added
+    col.add_calculated_column('{0} + 1')
+    col.transaction.commit()
+    assert list(col[0]) == [1, 3, 2]
+
+
+def test_new_cols_empty():
+    # columns of an empty collection are not checked against its rows
+    Collection([], calculated_columns=['{0} + {1}'])
+    Collection([], formatted_columns=['{0}-{1}'])
+    col = NamedCollection(('a', 'b'), [],
+            calculated_columns=[('c', '{a} + {b}')])
+    col.append([(1, 2)])
+    assert col[0] == {'a': 1, 'b': 2, 'c': 3}
+
+    # unnamed collections take their width from the first rows added
+    col = Collection([], calculated_columns=['{0} + {1}'])
+    col.append([(1, 2)])
+    assert (list(col[0]), col.width) == ([1, 2, 3], 3)
+    col = Collection([])
+    col.append([(1, 2)])
+    col.add_calculated_column('{0} + {1}')
+    col.add_formatted_column('x')
+    assert list(col[0]) == [1, 2, 3, 'x']
+
+
 def test_error_correction():
     col = Collection([[1]])
     col.transaction.begin()